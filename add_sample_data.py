@@ -1,14 +1,16 @@
 from backend import app, db, PilotProfile, User
+from gazetteer import geocode_many
 import bcrypt
 
 with app.app_context():
     # Crear usuarios pilotos de ejemplo si no existen
     pilots_data = [
-        {"name": "Carlos Madrid", "location": "Madrid", "lat": 40.4168, "lng": -3.7038, "rate": 75},
-        {"name": "Ana Barcelona", "location": "Barcelona", "lat": 41.3851, "lng": 2.1734, "rate": 85},
-        {"name": "Luis Valencia", "location": "Valencia", "lat": 39.4699, "lng": -0.3763, "rate": 65},
-        {"name": "María Sevilla", "location": "Sevilla", "lat": 37.3886, "lng": -5.9823, "rate": 70},
+        {"name": "Carlos Madrid", "location": "Madrid", "rate": 75},
+        {"name": "Ana Barcelona", "location": "Barcelona", "rate": 85},
+        {"name": "Luis Valencia", "location": "Valencia", "rate": 65},
+        {"name": "María Sevilla", "location": "Sevilla", "rate": 70},
     ]
+    places = geocode_many(p["location"] for p in pilots_data)
     
     for pilot_data in pilots_data:
         email = f"{pilot_data['name'].replace(' ', '_').lower()}@test.com"
@@ -30,11 +32,12 @@ with app.app_context():
         db.session.flush()
         
         # Crear perfil de piloto
+        place = places.get(pilot_data["location"]) or {}
         profile = PilotProfile(
             name=pilot_data["name"],
             location=pilot_data["location"],
-            latitude=pilot_data["lat"],
-            longitude=pilot_data["lng"],
+            latitude=place.get("lat"),
+            longitude=place.get("lng"),
             hourly_rate=pilot_data["rate"],
             tagline="Piloto profesional especializado en eventos",
             bio="Experiencia en grabación aérea y eventos especiales",
@@ -205,6 +205,20 @@ def get_pilot_detail(profile_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+NEARBY_PILOTS_SQL = '''
+    SELECT pp.*, u.username,
+           earth_distance(ll_to_earth(%(lat)s, %(lng)s),
+                          ll_to_earth(pp.latitude, pp.longitude)) / 1000.0 AS distance
+    FROM pilot_profiles pp
+    JOIN users u ON pp.user_id = u.id
+    WHERE pp.latitude IS NOT NULL AND pp.longitude IS NOT NULL
+      AND earth_box(ll_to_earth(%(lat)s, %(lng)s), %(radius_m)s) @> ll_to_earth(pp.latitude, pp.longitude)
+      AND earth_distance(ll_to_earth(%(lat)s, %(lng)s),
+                         ll_to_earth(pp.latitude, pp.longitude)) < %(radius_m)s
+    ORDER BY distance
+    LIMIT %(limit)s
+'''
+
 @app.route('/api/pilots/nearby', methods=['POST'])
 def get_nearby_pilots():
     try:
@@ -212,24 +226,22 @@ def get_nearby_pilots():
         user_lat = data.get('latitude')
         user_lng = data.get('longitude')
         radius = data.get('radius', 25)
+        limit = max(1, min(int(data.get('limit', 100)), 500))
+        
+        if user_lat is None or user_lng is None:
+            return jsonify({'error': 'Coordenadas requeridas'}), 400
         
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # Usar fórmula Haversine para calcular distancia
-        cur.execute('''
-            SELECT pp.*, u.username,
-                   (6371 * acos(
-                       cos(radians(%s)) * cos(radians(latitude)) *
-                       cos(radians(longitude) - radians(%s)) +
-                       sin(radians(%s)) * sin(radians(latitude))
-                   )) AS distance
-            FROM pilot_profiles pp
-            JOIN users u ON pp.user_id = u.id
-            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
-            HAVING distance < %s
-            ORDER BY distance
-        ''', (user_lat, user_lng, user_lat, radius))
+        # earth_box usa el índice GiST sobre ll_to_earth(latitude, longitude)
+        # (ver setup_geo_index.py); earth_distance descarta las esquinas de la caja
+        cur.execute(NEARBY_PILOTS_SQL, {
+            'lat': float(user_lat),
+            'lng': float(user_lng),
+            'radius_m': float(radius) * 1000,
+            'limit': limit
+        })
         
         pilots = cur.fetchall()
         cur.close()
@@ -854,12 +866,20 @@ def get_messages(conversation_id):
         
         conversation = cur.fetchone()
         
-        # Obtener mensajes
-        cur.execute('''
-            SELECT * FROM messages 
-            WHERE conversation_id = %s 
-            ORDER BY created_at ASC
-        ''', (conversation_id,))
+        # Obtener mensajes (con after_id, solo los posteriores a ese id: sincronización incremental)
+        after_id = request.args.get('after_id', type=int)
+        if after_id is not None:
+            cur.execute('''
+                SELECT * FROM messages 
+                WHERE conversation_id = %s AND id > %s 
+                ORDER BY id ASC
+            ''', (conversation_id, after_id))
+        else:
+            cur.execute('''
+                SELECT * FROM messages 
+                WHERE conversation_id = %s 
+                ORDER BY created_at ASC
+            ''', (conversation_id,))
         
         messages = cur.fetchall()
         
@@ -868,13 +888,13 @@ def get_messages(conversation_id):
             cur.execute('''
                 UPDATE messages 
                 SET is_read = TRUE 
-                WHERE conversation_id = %s AND sender_type = 'pilot'
+                WHERE conversation_id = %s AND sender_type = 'pilot' AND is_read = FALSE
             ''', (conversation_id,))
         else:
             cur.execute('''
                 UPDATE messages 
                 SET is_read = TRUE 
-                WHERE conversation_id = %s AND sender_type = 'client'
+                WHERE conversation_id = %s AND sender_type = 'client' AND is_read = FALSE
             ''', (conversation_id,))
         
         conn.commit()
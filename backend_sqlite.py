@@ -1,18 +1,36 @@
 import os
 import google.generativeai as genai
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory, Response, g, has_app_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 import bcrypt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from werkzeug.utils import secure_filename
 import stripe
 import json
-from math import radians, sin, cos, sqrt, atan2
+import hashlib
+import queue
+import threading
+import time
+from functools import wraps
+from sqlalchemy import inspect as sa_inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm.attributes import set_committed_value
+import numpy as np
+import click
+from cache import LRUCache, MemoryCacheBackend, SQLiteCacheBackend, RecommendationCache
+from geo import bounding_box, haversine_km, PilotSpatialIndex
+from text_index import PilotTextIndex
+from facets import PilotFacetIndex, PRICE_BUCKETS
+from mailer import mailer_from_env, render_email
+from chat_broker import broker_from_env
+from scheduling import to_minutes, format_minutes, merge_intervals, subtract_intervals, covers, DayAgenda
+from gazetteer import geocode
+from query_parser import parse_search_query, normalize_query
 
 # --- CONFIGURACIÓN ---
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 UPLOAD_FOLDER = os.path.join(app.instance_path, 'static', 'uploads')
@@ -33,6 +51,21 @@ else:
     print("Advertencia: GOOGLE_API_KEY no encontrada. La búsqueda con IA estará desactivada.")
     model = None
 
+# --- CONFIGURACIÓN CACHÉ DE BÚSQUEDAS IA ---
+# 'sqlite' comparte la caché entre los workers de gunicorn; 'memory' es por proceso
+SEARCH_CACHE_BACKEND = os.environ.get('SEARCH_CACHE_BACKEND', 'sqlite')
+SEARCH_CACHE_PATH = os.environ.get('SEARCH_CACHE_PATH', os.path.join(app.instance_path, 'search_cache.db'))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 6 * 3600))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 1000))
+# Tiempo máximo que una búsqueda en streaming espera a la IA antes de devolver el ranking local
+SEARCH_STREAM_DEADLINE = float(os.environ.get('SEARCH_STREAM_DEADLINE', 8))
+
+if SEARCH_CACHE_BACKEND == 'sqlite':
+    search_cache_backend = SQLiteCacheBackend(SEARCH_CACHE_PATH, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+else:
+    search_cache_backend = MemoryCacheBackend(max_entries=SEARCH_CACHE_MAX_ENTRIES)
+recommendation_cache = RecommendationCache(search_cache_backend, ttl=SEARCH_CACHE_TTL)
+
 # --- CONFIGURACIÓN STRIPE ---
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY', 'pk_test_51234567890abcdef')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', 'sk_test_51234567890abcdef')
@@ -60,11 +93,48 @@ class PilotProfile(db.Model):
     phone = db.Column(db.String(20))
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
     bookings_received = db.relationship('Booking', foreign_keys='Booking.pilot_profile_id', backref='pilot', lazy=True)
     services = db.relationship('ServicePackage', backref='profile', lazy=True, cascade="all, delete-orphan")
     portfolio_items = db.relationship('PortfolioItem', backref='profile', lazy=True, cascade="all, delete-orphan")
     availability_slots = db.relationship('AvailabilitySlot', backref='profile', lazy=True, cascade="all, delete-orphan")
+    availability_rules = db.relationship('AvailabilityRule', backref='profile', lazy=True, cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        db.Index('ix_pilot_profile_lat_lng', 'latitude', 'longitude'),
+        db.Index('ix_pilot_profile_hourly_rate', 'hourly_rate'),
+    )
+    
+    @property
+    def average_rating(self):
+        return round(self.rating_sum / self.rating_count, 1) if self.rating_count else 0
+    
+    def apply_review_rating(self, rating, delta=1):
+        """Actualiza los agregados de reviews (delta=1 al añadir, -1 al borrar).
+
+        El incremento se hace en SQL (SET x = x + delta) para no perder reviews simultáneas;
+        los valores en memoria se refrescan al hacer commit.
+        """
+        column = getattr(PilotProfile, f"rating_{int(rating)}")
+        PilotProfile.query.filter_by(id=self.id).update({
+            PilotProfile.rating_count: PilotProfile.rating_count + delta,
+            PilotProfile.rating_sum: PilotProfile.rating_sum + delta * int(rating),
+            column: column + delta,
+        }, synchronize_session=False)
+    
+    def rating_stats(self):
+        return {
+            "total_reviews": self.rating_count or 0,
+            "average_rating": self.average_rating,
+            "rating_histogram": {str(i): getattr(self, f"rating_{i}") or 0 for i in range(1, 6)}
+        }
     
     def to_dict(self):
         return {
@@ -76,6 +146,7 @@ class PilotProfile(db.Model):
             "eventPackages": [s.to_dict() for s in self.services],
             "portfolio": [item.to_dict() for item in self.portfolio_items],
             "availability": [slot.to_dict() for slot in self.availability_slots],
+            "availability_rules": [rule.to_dict() for rule in self.availability_rules],
             "certifications": [cert.to_dict() for cert in self.certifications],
             "badges": [badge.to_dict() for badge in self.badges],
             "is_verified": any(cert.verification_status == 'verified' for cert in self.certifications)
@@ -90,6 +161,10 @@ class AvailabilitySlot(db.Model):
     is_available = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_availability_slot_pilot_date', 'pilot_profile_id', 'date'),
+    )
+    
     def to_dict(self):
         return {
             "id": self.id,
@@ -99,6 +174,55 @@ class AvailabilitySlot(db.Model):
             "is_available": self.is_available
         }
 
+class AvailabilityRule(db.Model):
+    """Disponibilidad semanal recurrente; se expande solo para las fechas consultadas"""
+    id = db.Column(db.Integer, primary_key=True)
+    pilot_profile_id = db.Column(db.Integer, db.ForeignKey('pilot_profile.id'), nullable=False)
+    weekdays = db.Column(db.Integer, nullable=False)  # bit 0 = lunes ... bit 6 = domingo
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    valid_from = db.Column(db.Date, nullable=False)
+    valid_until = db.Column(db.Date, nullable=True)
+    exceptions = db.Column(db.Text, nullable=False, default='[]')  # fechas ISO sin disponibilidad
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_availability_rule_pilot_valid', 'pilot_profile_id', 'valid_from'),
+    )
+    
+    @staticmethod
+    def active_on(day):
+        """Condición SQL: reglas vigentes ese día y que incluyen su día de la semana"""
+        return db.and_(
+            AvailabilityRule.weekdays.op('&')(1 << day.weekday()) != 0,
+            AvailabilityRule.valid_from <= day,
+            db.or_(AvailabilityRule.valid_until.is_(None), AvailabilityRule.valid_until >= day)
+        )
+    
+    def exception_dates(self):
+        return set(json.loads(self.exceptions or '[]'))
+    
+    def occurs_on(self, day, exception_dates=None):
+        if exception_dates is None:
+            exception_dates = self.exception_dates()
+        return bool(
+            self.weekdays & (1 << day.weekday())
+            and self.valid_from <= day
+            and (self.valid_until is None or day <= self.valid_until)
+            and day.isoformat() not in exception_dates
+        )
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "weekdays": [i for i in range(7) if self.weekdays & (1 << i)],
+            "start_time": self.start_time.strftime('%H:%M'),
+            "end_time": self.end_time.strftime('%H:%M'),
+            "valid_from": self.valid_from.isoformat(),
+            "valid_until": self.valid_until.isoformat() if self.valid_until else None,
+            "exceptions": sorted(self.exception_dates())
+        }
+
 class ServicePackage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -107,6 +231,10 @@ class ServicePackage(db.Model):
     duration_hours = db.Column(db.Integer, default=2)
     pilot_profile_id = db.Column(db.Integer, db.ForeignKey('pilot_profile.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_service_package_price_pilot', 'price', 'pilot_profile_id'),
+    )
+    
     def to_dict(self):
         return {
             "id": self.id, "name": self.name, 
@@ -127,12 +255,27 @@ class Booking(db.Model):
     pilot_profile_id = db.Column(db.Integer, db.ForeignKey('pilot_profile.id'), nullable=False)
     service_package_id = db.Column(db.Integer, db.ForeignKey('service_package.id'), nullable=True)
     
+    __table_args__ = (
+        db.Index('ix_booking_pilot_date', 'pilot_profile_id', 'booking_date'),
+    )
+    
     def to_dict(self):
-        client_user = User.query.get(self.client_id)
-        pilot_profile = PilotProfile.query.get(self.pilot_profile_id)
+        client_user = get_cached(User, self.client_id)
+        pilot_profile = get_cached(PilotProfile, self.pilot_profile_id)
         service = ServicePackage.query.get(self.service_package_id) if self.service_package_id else None
         payment = Payment.query.filter_by(booking_id=self.id).first()
         
+        return self.to_dict_with(
+            client_username=client_user.username,
+            client_email=client_user.email,
+            pilot_name=pilot_profile.name,
+            service_name=service.name if service else None,
+            payment_status=payment.status if payment else None,
+            payment_id=payment.id if payment else None
+        )
+    
+    def to_dict_with(self, client_username, client_email, pilot_name, service_name, payment_status, payment_id):
+        """Serializa con los datos relacionados ya cargados (ver booking_rows_to_dicts)"""
         return {
             "id": self.id, 
             "job_description": self.job_description, 
@@ -142,13 +285,13 @@ class Booking(db.Model):
             "end_time": self.end_time.strftime('%H:%M'),
             "total_price": self.total_price,
             "created_at": self.created_at.isoformat(),
-            "client_username": client_user.username,
-            "client_email": client_user.email,
-            "pilot_name": pilot_profile.name,
+            "client_username": client_username,
+            "client_email": client_email,
+            "pilot_name": pilot_name,
             "pilot_profile_id": self.pilot_profile_id,
-            "service_name": service.name if service else "Servicio personalizado",
-            "payment_status": payment.status if payment else "no_payment",
-            "payment_id": payment.id if payment else None
+            "service_name": service_name or "Servicio personalizado",
+            "payment_status": payment_status or "no_payment",
+            "payment_id": payment_id
         }
 
 class PortfolioItem(db.Model):
@@ -175,7 +318,7 @@ class Review(db.Model):
     booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=True)
     
     def to_dict(self):
-        client = User.query.get(self.client_id)
+        client = get_cached(User, self.client_id)
         return {
             "id": self.id,
             "rating": self.rating,
@@ -232,6 +375,10 @@ class Badge(db.Model):
     
     pilot_profile = db.relationship('PilotProfile', backref='badges')
     
+    __table_args__ = (
+        db.Index('ix_badge_type_pilot', 'badge_type', 'pilot_profile_id'),
+    )
+    
     def to_dict(self):
         return {
             "id": self.id,
@@ -291,13 +438,35 @@ class Conversation(db.Model):
     pilot_profile_id = db.Column(db.Integer, db.ForeignKey('pilot_profile.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     last_message_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Mensajes pendientes de leer por cada participante; se mantienen en send_message/get_messages
+    client_unread = db.Column(db.Integer, nullable=False, default=0)
+    pilot_unread = db.Column(db.Integer, nullable=False, default=0)
+    # Resumen del último mensaje para la bandeja de entrada (se actualiza en send_message)
+    last_message_preview = db.Column(db.String(200))
+    last_message_sender = db.Column(db.String(20))
+    last_message_id = db.Column(db.Integer)
+    # Marca de lectura: los mensajes del otro participante con id <= marca ya están leídos
+    client_last_read_id = db.Column(db.Integer)
+    pilot_last_read_id = db.Column(db.Integer)
     
     client = db.relationship('User', backref='client_conversations')
     pilot_profile = db.relationship('PilotProfile', backref='pilot_conversations')
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
     
-    def to_dict(self):
-        last_message = Message.query.filter_by(conversation_id=self.id).order_by(Message.created_at.desc()).first()
+    __table_args__ = (
+        db.Index('ix_conversation_client_last_message', 'client_id', 'last_message_at'),
+        db.Index('ix_conversation_pilot_last_message', 'pilot_profile_id', 'last_message_at'),
+    )
+    
+    def unread_for(self, viewer_type):
+        if viewer_type == 'client':
+            return self.client_unread or 0
+        if viewer_type == 'pilot':
+            return self.pilot_unread or 0
+        return 0
+    
+    def to_dict(self, viewer_type=None):
+        """viewer_type ('client'/'pilot') indica de qué participante es unread_count"""
         return {
             "id": self.id,
             "client_id": self.client_id,
@@ -308,9 +477,9 @@ class Conversation(db.Model):
             "client_avatar": f"https://picsum.photos/seed/client{self.client_id}/50/50",
             "created_at": self.created_at.isoformat(),
             "last_message_at": self.last_message_at.isoformat(),
-            "last_message": last_message.content if last_message else "Inicia la conversación",
-            "last_message_sender": last_message.sender_type if last_message else None,
-            "unread_count": 0
+            "last_message": self.last_message_preview or "Inicia la conversación",
+            "last_message_sender": self.last_message_sender,
+            "unread_count": self.unread_for(viewer_type)
         }
 
 class Message(db.Model):
@@ -322,16 +491,16 @@ class Message(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
     
-    def to_dict(self):
-        if self.sender_type == 'client':
-            sender = User.query.get(self.sender_id)
-            sender_name = sender.username if sender else "Cliente eliminado"
-            sender_avatar = f"https://picsum.photos/seed/client{self.sender_id}/40/40"
+    __table_args__ = (
+        db.Index('ix_message_conversation_id', 'conversation_id', 'id'),
+    )
+    
+    def to_dict(self, participants=None):
+        """participants: {sender_type: (nombre, avatar)} ya resueltos (ver messages_to_dicts)"""
+        if participants and self.sender_type in participants:
+            sender_name, sender_avatar = participants[self.sender_type]
         else:
-            sender = User.query.get(self.sender_id)
-            pilot_profile = sender.pilot_profile if sender else None
-            sender_name = pilot_profile.name if pilot_profile else "Piloto eliminado"
-            sender_avatar = f"https://picsum.photos/seed/{pilot_profile.id}/40/40" if pilot_profile else ""
+            sender_name, sender_avatar = sender_display(self.sender_type, self.sender_id)
         
         return {
             "id": self.id,
@@ -386,45 +555,890 @@ class Payment(db.Model):
             "completed_at": self.completed_at.isoformat() if self.completed_at else None
         }
 
+class CatalogState(db.Model):
+    """Fila única con la versión del catálogo de pilotos; cada escritura la incrementa"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+class Job(db.Model):
+    """Trabajo pendiente de la cola local; se inserta en la misma transacción que la escritura que lo origina"""
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    # Trabajos del mismo tipo y clave se ejecutan juntos (p. ej. emails a un mismo destinatario)
+    coalesce_key = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('ix_job_coalesce', 'job_type', 'coalesce_key', 'status'),
+    )
+
 # --- INICIALIZACIÓN DE LA BD ---
+def _column_ddl(column, dialect):
+    ddl = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if isinstance(default, bool):
+        default = int(default)
+    if isinstance(default, (int, float)):
+        ddl += f" DEFAULT {default}"
+    elif isinstance(default, str):
+        ddl += " DEFAULT '{}'".format(default.replace("'", "''"))
+    else:
+        return ddl
+    return ddl + ("" if column.nullable else " NOT NULL")
+
+def migrate_schema():
+    """Añade a las tablas existentes las columnas e índices nuevos de los modelos (idempotente).
+
+    db.create_all() solo crea tablas que no existen; no altera las que ya hay en la BD.
+    Devuelve la lista de columnas añadidas como "tabla.columna".
+    """
+    added = []
+    dialect = db.engine.dialect
+    for table in db.metadata.sorted_tables:
+        inspector = sa_inspect(db.engine)
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {dialect.identifier_preparer.quote(table.name)} "
+                        f"ADD COLUMN {_column_ddl(column, dialect)}"
+                    ))
+                added.append(f"{table.name}.{column.name}")
+            except (OperationalError, ProgrammingError):
+                # Otro worker puede haberla añadido a la vez; solo es un error si sigue faltando
+                columns = {c['name'] for c in sa_inspect(db.engine).get_columns(table.name)}
+                if column.name not in columns:
+                    raise
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    return added
+
 with app.app_context():
     db.create_all()
+    schema_added_columns = migrate_schema()
+    if schema_added_columns:
+        print(f"✅ Columnas añadidas a la BD existente: {', '.join(schema_added_columns)}")
+    if not CatalogState.query.get(1):
+        db.session.add(CatalogState(id=1, version=1))
+        db.session.commit()
     print("✅ Base de datos inicializada con todas las tablas")
 
-# --- FUNCIONES HELPER PARA NOTIFICACIONES ---
-def create_notification(user_id, notification_type, title, message, link=None, related_id=None):
-    """Crear una notificación in-app"""
+# --- VERSIÓN DEL CATÁLOGO Y CACHÉ DE RESPUESTAS ---
+catalog_response_cache = LRUCache(max_entries=512)
+
+def get_catalog_version():
+    return db.session.query(CatalogState.version).filter_by(id=1).scalar() or 0
+
+def bump_catalog_version():
+    """Invalida las respuestas cacheadas del catálogo; se confirma junto con la escritura.
+    
+    Devuelve la versión anterior para poder pasarla a sync_catalog_indexes().
+    """
+    version_before = get_catalog_version()
+    CatalogState.query.filter_by(id=1).update({CatalogState.version: CatalogState.version + 1})
+    return version_before
+
+def catalog_cached(f):
+    """Cachea respuestas GET del catálogo por versión y responde 304 si el ETag coincide"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        version = get_catalog_version()
+        path_hash = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+        etag = f"v{version}-{path_hash}"
+        
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            cached = catalog_response_cache.get(etag)
+            if cached is None:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                cached = (response.get_data(), dict(response.headers))
+                catalog_response_cache.set(etag, cached)
+            body, headers = cached
+            response = app.response_class(body, status=200, headers=headers)
+        
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return decorated_function
+
+# --- AGREGADOS DE REVIEWS ---
+def rebuild_rating_aggregates():
+    """Recalcula rating_count/rating_sum/histograma de todos los pilotos con un único GROUP BY"""
+    rows = db.session.query(
+        Review.pilot_profile_id, Review.rating, db.func.count(Review.id)
+    ).group_by(Review.pilot_profile_id, Review.rating).all()
+    
+    stats = {}
+    for pilot_profile_id, rating, count in rows:
+        if rating not in range(1, 6):
+            continue
+        entry = stats.setdefault(pilot_profile_id, {f"rating_{i}": 0 for i in range(1, 6)})
+        entry[f"rating_{rating}"] = count
+    
+    updated = 0
+    for profile in PilotProfile.query.all():
+        entry = stats.get(profile.id, {f"rating_{i}": 0 for i in range(1, 6)})
+        for column, count in entry.items():
+            setattr(profile, column, count)
+        profile.rating_count = sum(entry.values())
+        profile.rating_sum = sum(i * entry[f"rating_{i}"] for i in range(1, 6))
+        updated += 1
+    
+    bump_catalog_version()
+    db.session.commit()
+    return updated
+
+@app.cli.command("rebuild-ratings")
+def rebuild_ratings_command():
+    """Recalcula los agregados de reviews: flask --app backend_sqlite rebuild-ratings"""
+    updated = rebuild_rating_aggregates()
+    print(f"✅ Agregados de reviews recalculados para {updated} pilotos")
+
+# Columnas desnormalizadas -> recálculo que hay que lanzar cuando migrate_schema() las añade
+SCHEMA_BACKFILLS = [
+    ("pilot_profile.rating_count", rebuild_rating_aggregates),
+]
+
+def run_schema_backfills(added_columns):
+    done = set()
+    for column, backfill in SCHEMA_BACKFILLS:
+        # Varias columnas pueden compartir recálculo: se lanza una sola vez
+        if column in added_columns and backfill not in done:
+            backfill()
+            done.add(backfill)
+            print(f"✅ Recalculado tras añadir {column}")
+
+@app.cli.command("migrate-db")
+def migrate_db_command():
+    """Añade columnas/índices nuevos y recalcula sus datos: flask --app backend_sqlite migrate-db"""
+    added = migrate_schema()
+    print(f"✅ Esquema al día ({len(added)} columnas añadidas)")
+    run_schema_backfills(added)
+
+# --- CACHÉ DE IDENTIDADES POR PETICIÓN ---
+def get_cached(model, obj_id):
+    """model.query.get() recordado durante la petición (g), para no repetir la búsqueda en cada serializador"""
+    if obj_id is None:
+        return None
+    if not has_app_context():
+        return model.query.get(obj_id)
+    if 'identity_cache' not in g:
+        g.identity_cache = {}
+    key = (model.__name__, obj_id)
+    if key not in g.identity_cache:
+        g.identity_cache[key] = model.query.get(obj_id)
+    return g.identity_cache[key]
+
+def sender_display(sender_type, sender_id):
+    """(nombre, avatar) del remitente de un mensaje"""
+    sender = get_cached(User, sender_id)
+    if sender_type == 'client':
+        return (sender.username if sender else "Cliente eliminado",
+                f"https://picsum.photos/seed/client{sender_id}/40/40")
+    pilot_profile = sender.pilot_profile if sender else None
+    if not pilot_profile:
+        return "Piloto eliminado", ""
+    return pilot_profile.name, f"https://picsum.photos/seed/{pilot_profile.id}/40/40"
+
+def messages_to_dicts(conversation, messages):
+    """Serializa mensajes de una conversación resolviendo sus dos participantes una sola vez"""
+    if not messages:
+        return []  # sondeo sin novedades: no hace falta resolver a nadie
+    participants = {
+        'client': sender_display('client', conversation.client_id),
+        'pilot': sender_display('pilot', conversation.pilot_profile.user_id)
+    }
+    return [msg.to_dict(participants) for msg in messages]
+
+# --- SERIALIZACIÓN EN BLOQUE DE PILOTOS ---
+PILOT_CHILD_RELATIONS = (
+    ("services", ServicePackage),
+    ("portfolio_items", PortfolioItem),
+    ("availability_slots", AvailabilitySlot),
+    ("availability_rules", AvailabilityRule),
+    ("certifications", Certification),
+    ("badges", Badge),
+)
+
+def preload_pilot_relations(profiles):
+    """Carga las relaciones hijas de varios perfiles con una consulta IN por relación"""
+    profiles = [p for p in profiles if p is not None]
+    if not profiles:
+        return profiles
+    
+    ids = [p.id for p in profiles]
+    for attr, model in PILOT_CHILD_RELATIONS:
+        grouped = {profile_id: [] for profile_id in ids}
+        rows = model.query.filter(model.pilot_profile_id.in_(ids)).order_by(model.id).all()
+        for row in rows:
+            grouped[row.pilot_profile_id].append(row)
+        for profile in profiles:
+            set_committed_value(profile, attr, grouped[profile.id])
+    return profiles
+
+def pilots_to_dicts(profiles):
+    """Serializa una lista de perfiles con un número constante de consultas"""
+    profiles = preload_pilot_relations(profiles)
+    return [p.to_dict() for p in profiles]
+
+# --- LISTADOS DE RESERVAS ---
+BOOKINGS_PAGE_MAX = 100
+
+def booking_rows_query():
+    """Reservas con cliente, piloto, servicio y último pago en una sola consulta con JOIN"""
+    latest_payment = db.session.query(
+        Payment.booking_id, db.func.max(Payment.id).label('payment_id')
+    ).group_by(Payment.booking_id).subquery()
+    
+    return db.session.query(
+        Booking, User.username, User.email, PilotProfile.name, ServicePackage.name, Payment.status, Payment.id
+    ).join(
+        User, User.id == Booking.client_id
+    ).join(
+        PilotProfile, PilotProfile.id == Booking.pilot_profile_id
+    ).outerjoin(
+        ServicePackage, ServicePackage.id == Booking.service_package_id
+    ).outerjoin(
+        latest_payment, latest_payment.c.booking_id == Booking.id
+    ).outerjoin(
+        Payment, Payment.id == latest_payment.c.payment_id
+    )
+
+def booking_rows_to_dicts(rows):
+    return [booking.to_dict_with(*related) for booking, *related in rows]
+
+def paginate_bookings(query, args):
+    """Aplica filtros status/date_from/date_to y paginación por cursor (id descendente).
+    
+    Devuelve (filas, siguiente cursor o None) o lanza ValueError si un parámetro es inválido.
+    """
+    statuses = [st.strip() for st in args.get('status', '').split(',') if st.strip()]
+    if statuses:
+        query = query.filter(Booking.status.in_(statuses))
+    if args.get('date_from'):
+        query = query.filter(Booking.booking_date >= datetime.strptime(args['date_from'], '%Y-%m-%d').date())
+    if args.get('date_to'):
+        query = query.filter(Booking.booking_date <= datetime.strptime(args['date_to'], '%Y-%m-%d').date())
+    if args.get('cursor'):
+        query = query.filter(Booking.id < int(args['cursor']))
+    query = query.order_by(Booking.id.desc())
+    
+    limit = args.get('limit', type=int)
+    if limit is None:
+        return query.all(), None
+    limit = max(1, min(limit, BOOKINGS_PAGE_MAX))
+    rows = query.limit(limit + 1).all()
+    next_cursor = str(rows[limit - 1][0].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def bookings_page_response(query):
     try:
-        notification = Notification(
-            user_id=user_id,
-            notification_type=notification_type,
-            title=title,
-            message=message,
-            link=link,
-            related_id=related_id
+        rows, next_cursor = paginate_bookings(query, request.args)
+    except ValueError:
+        return jsonify({"error": "Filtro o cursor inválido"}), 400
+    
+    response = jsonify(booking_rows_to_dicts(rows))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# --- BÚSQUEDA GEOGRÁFICA ---
+def find_pilots_within(lat, lng, radius_km, query=None):
+    """Devuelve [(perfil, distancia_km)] ordenados por distancia dentro del radio.
+    
+    La caja envolvente usa el índice (latitude, longitude) para traer solo
+    candidatos; la distancia exacta se calcula en una única pasada NumPy.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    if min_lng < -180.0 or max_lng > 180.0:
+        lng_filter = db.or_(
+            PilotProfile.longitude >= (min_lng + 360.0 if min_lng < -180.0 else min_lng),
+            PilotProfile.longitude <= (max_lng - 360.0 if max_lng > 180.0 else max_lng)
         )
-        db.session.add(notification)
-        db.session.commit()
-        return notification
+    else:
+        lng_filter = PilotProfile.longitude.between(min_lng, max_lng)
+    
+    candidates = (query or db.session.query(PilotProfile)).with_entities(
+        PilotProfile.id, PilotProfile.latitude, PilotProfile.longitude
+    ).filter(PilotProfile.latitude.between(min_lat, max_lat), lng_filter).all()
+    if not candidates:
+        return []
+    
+    ids, lats, lngs = zip(*candidates)
+    distances = haversine_km(lat, lng, lats, lngs)
+    in_radius = {pid: float(d) for pid, d in zip(ids, distances) if d <= radius_km}
+    if not in_radius:
+        return []
+    
+    profiles = PilotProfile.query.filter(PilotProfile.id.in_(in_radius.keys())).all()
+    return sorted(((p, in_radius[p.id]) for p in profiles), key=lambda item: item[1])
+
+# --- ÍNDICES EN MEMORIA DEL CATÁLOGO ---
+pilot_spatial_index = PilotSpatialIndex()
+pilot_text_index = PilotTextIndex()
+pilot_facet_index = PilotFacetIndex()
+
+def ensure_spatial_index():
+    """Reconstruye el KD-tree si el catálogo cambió desde otro proceso"""
+    version = get_catalog_version()
+    if pilot_spatial_index.version != version:
+        rows = db.session.query(PilotProfile.id, PilotProfile.latitude, PilotProfile.longitude).filter(
+            PilotProfile.latitude.isnot(None),
+            PilotProfile.longitude.isnot(None)
+        ).all()
+        pilot_spatial_index.rebuild(rows, version)
+    return pilot_spatial_index
+
+def load_pilot_documents(ids=None):
+    """Devuelve [(pilot_id, [(texto, peso)], datos)] para los índices de texto y facetas con 4 consultas"""
+    query = PilotProfile.query
+    if ids is not None:
+        query = query.filter(PilotProfile.id.in_(ids))
+    profiles = query.all()
+    ids = [p.id for p in profiles]
+    if not ids:
+        return []
+    
+    services, badges = {}, {}
+    for service in ServicePackage.query.filter(ServicePackage.pilot_profile_id.in_(ids)):
+        services.setdefault(service.pilot_profile_id, []).append(service)
+    for badge in Badge.query.filter(Badge.pilot_profile_id.in_(ids)):
+        badges.setdefault(badge.pilot_profile_id, []).append(badge)
+    verified_ids = {
+        row[0] for row in db.session.query(Certification.pilot_profile_id).filter(
+            Certification.pilot_profile_id.in_(ids),
+            Certification.verification_status == 'verified'
+        ).distinct()
+    }
+    
+    documents = []
+    for profile in profiles:
+        pilot_services = services.get(profile.id, [])
+        pilot_badges = badges.get(profile.id, [])
+        fields = [(profile.name, 3), (profile.tagline, 2), (profile.location, 2), (profile.bio, 1)]
+        fields += [(b.name, 2) for b in pilot_badges]
+        fields += [(f"{s.name} {s.description}", 1) for s in pilot_services]
+        prices = [s.price for s in pilot_services] + [profile.hourly_rate or 0]
+        place = geocode(profile.location) if profile.location else None
+        facts = {
+            "from_price": min(prices),
+            "badge_types": frozenset(b.badge_type for b in pilot_badges),
+            "is_verified": profile.id in verified_ids,
+            "city": place["name"] if place else None,
+            "average_rating": profile.average_rating,
+            "rating_count": profile.rating_count or 0,
+            "latitude": profile.latitude,
+            "longitude": profile.longitude,
+        }
+        documents.append((profile.id, fields, facts))
+    return documents
+
+def ensure_text_index():
+    """Reconstruye el índice de texto si el catálogo cambió desde otro proceso"""
+    version = get_catalog_version()
+    if pilot_text_index.version != version:
+        pilot_text_index.rebuild(load_pilot_documents(), version)
+    return pilot_text_index
+
+def ensure_facet_index():
+    """Reconstruye los bitsets de facetas si el catálogo cambió desde otro proceso"""
+    version = get_catalog_version()
+    if pilot_facet_index.version != version:
+        rows = [(pid, facts) for pid, _, facts in load_pilot_documents()]
+        pilot_facet_index.rebuild(rows, version)
+    return pilot_facet_index
+
+def sync_catalog_indexes(pilot_profile_id, version_before):
+    """Aplica una escritura ya confirmada a los índices en memoria sin reconstruirlos.
+    
+    Solo es posible si el índice estaba al día y nadie más escribió entre medias;
+    en otro caso se queda desfasado y se reconstruye en la siguiente consulta.
+    """
+    try:
+        version_after = get_catalog_version()
+        if version_after != version_before + 1:
+            return
+        profile = PilotProfile.query.get(pilot_profile_id)
+        if pilot_spatial_index.version == version_before:
+            if profile:
+                pilot_spatial_index.upsert(profile.id, profile.latitude, profile.longitude)
+            else:
+                pilot_spatial_index.remove(pilot_profile_id)
+            pilot_spatial_index.version = version_after
+        
+        text_current = pilot_text_index.version == version_before
+        facets_current = pilot_facet_index.version == version_before
+        if text_current or facets_current:
+            documents = load_pilot_documents([pilot_profile_id]) if profile else []
+            if text_current:
+                if documents:
+                    pilot_text_index.upsert(*documents[0])
+                else:
+                    pilot_text_index.remove(pilot_profile_id)
+                pilot_text_index.version = version_after
+            if facets_current:
+                if documents:
+                    pilot_facet_index.upsert(pilot_profile_id, documents[0][2])
+                else:
+                    pilot_facet_index.remove(pilot_profile_id)
+                pilot_facet_index.version = version_after
     except Exception as e:
-        print(f"Error creando notificación: {e}")
-        return None
+        print(f"Error actualizando índices del catálogo: {e}")
+
+# --- BÚSQUEDA ESTRUCTURADA PARA LA IA ---
+SEARCH_TOP_N = 8
+SEARCH_CITY_RADIUS_KM = 50
+SEARCH_PROMPT_CHAR_BUDGET = 6000  # ~1500 tokens
+# Orden en el que se relajan los filtros si no hay resultados
+SEARCH_RELAX_ORDER = ("date", "budget", "badge_types", "city")
+
+def _filtered_pilots_query(filters, active):
+    query = PilotProfile.query
+    if "badge_types" in active:
+        query = query.filter(PilotProfile.id.in_(
+            db.session.query(Badge.pilot_profile_id).filter(Badge.badge_type.in_(filters["badge_types"]))
+        ))
+    if "budget" in active:
+        query = query.filter(db.or_(
+            PilotProfile.hourly_rate <= filters["budget"],
+            PilotProfile.id.in_(
+                db.session.query(ServicePackage.pilot_profile_id).filter(ServicePackage.price <= filters["budget"])
+            )
+        ))
+    if "date" in active:
+        query = query.filter(available_pilots_filter(filters["date"]))
+    return query
+
+def select_search_candidates(filters, limit=SEARCH_TOP_N):
+    """Devuelve ([(perfil, distancia_km o None)], filtros aplicados) con los mejores pilotos"""
+    active = [key for key in SEARCH_RELAX_ORDER if filters.get(key)]
+    average = db.func.coalesce(
+        PilotProfile.rating_sum * 1.0 / db.func.nullif(PilotProfile.rating_count, 0), 0
+    )
+    
+    while True:
+        query = _filtered_pilots_query(filters, active)
+        if "city" in active:
+            city = filters["city"]
+            ranked = find_pilots_within(city["lat"], city["lng"], SEARCH_CITY_RADIUS_KM, query)
+            ranked.sort(key=lambda item: (-item[0].average_rating, -(item[0].rating_count or 0), item[1]))
+            candidates = ranked[:limit]
+        else:
+            profiles = query.order_by(average.desc(), PilotProfile.rating_count.desc()).limit(limit).all()
+            candidates = [(p, None) for p in profiles]
+        
+        if candidates or not active:
+            return candidates, active
+        active.pop(0)
+
+def compact_pilot_lines(candidates, char_budget=SEARCH_PROMPT_CHAR_BUDGET):
+    """Una línea por piloto con lo justo para recomendar, sin pasar del presupuesto de caracteres"""
+    ids = [profile.id for profile, _ in candidates]
+    badges, services = {}, {}
+    if ids:
+        for badge in Badge.query.filter(Badge.pilot_profile_id.in_(ids)):
+            badges.setdefault(badge.pilot_profile_id, []).append(badge.name)
+        for service in ServicePackage.query.filter(ServicePackage.pilot_profile_id.in_(ids)).order_by(ServicePackage.price):
+            services.setdefault(service.pilot_profile_id, []).append(f"{service.name} €{service.price}")
+    
+    lines, used = [], 0
+    for profile, distance in candidates:
+        parts = [
+            f"#{profile.id} {profile.name}",
+            profile.tagline or "Piloto profesional",
+            profile.location or "Ubicación no especificada",
+            f"€{profile.hourly_rate}/h",
+            f"★{profile.average_rating} ({profile.rating_count or 0})",
+        ]
+        if distance is not None:
+            parts.append(f"a {round(distance)} km")
+        if badges.get(profile.id):
+            parts.append("especialidades: " + ", ".join(badges[profile.id]))
+        if services.get(profile.id):
+            parts.append("servicios: " + "; ".join(services[profile.id][:3]))
+        line = "- " + " | ".join(parts)
+        if used + len(line) > char_budget:
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return lines
+
+def describe_search_filters(filters, applied):
+    return {
+        "city": filters["city"]["name"] if filters.get("city") else None,
+        "budget": filters.get("budget"),
+        "date": filters["date"].isoformat() if filters.get("date") else None,
+        "badge_types": filters.get("badge_types") or [],
+        "applied": list(applied)
+    }
+
+# --- DISPONIBILIDAD ---
+# Reservas que ocupan la agenda del piloto
+BLOCKING_BOOKING_STATUSES = ('confirmed', 'paid', 'completed')
+
+# Ventana máxima (días) que se expande al consultar la disponibilidad de un piloto
+AVAILABILITY_WINDOW_MAX_DAYS = 62
 
-def send_email_notification(to_email, subject, html_content):
-    """Enviar email (simulado por ahora)"""
+def available_pilots_filter(day, start=None, end=None):
+    """Condición sobre PilotProfile.id: pilotos con huecos sueltos o reglas recurrentes ese día.
+    
+    Las excepciones de las reglas no se miran aquí; se descartan al expandir.
+    """
+    slot_ids = db.session.query(AvailabilitySlot.pilot_profile_id).filter(
+        AvailabilitySlot.date == day,
+        AvailabilitySlot.is_available == True
+    )
+    rule_ids = db.session.query(AvailabilityRule.pilot_profile_id).filter(AvailabilityRule.active_on(day))
+    if start is not None and end is not None:
+        slot_ids = slot_ids.filter(AvailabilitySlot.start_time < end, AvailabilitySlot.end_time > start)
+        rule_ids = rule_ids.filter(AvailabilityRule.start_time < end, AvailabilityRule.end_time > start)
+    return db.or_(PilotProfile.id.in_(slot_ids), PilotProfile.id.in_(rule_ids))
+
+def availability_intervals(pilot_ids, days, start=None, end=None):
+    """Devuelve {pilot_id: {día: [(inicio, fin)]}} uniendo huecos sueltos y reglas expandidas.
+    
+    Las reglas solo se expanden para los días pedidos; con start/end (datetime.time)
+    se descarta lo que no toca esa ventana.
+    """
+    pilot_ids, days = list(pilot_ids), set(days)
+    if not pilot_ids or not days:
+        return {}
+    
+    slots = db.session.query(
+        AvailabilitySlot.pilot_profile_id, AvailabilitySlot.date, AvailabilitySlot.start_time, AvailabilitySlot.end_time
+    ).filter(
+        AvailabilitySlot.pilot_profile_id.in_(pilot_ids),
+        AvailabilitySlot.date.in_(days),
+        AvailabilitySlot.is_available == True
+    )
+    weekday_mask = 0
+    for day in days:
+        weekday_mask |= 1 << day.weekday()
+    rules = AvailabilityRule.query.filter(
+        AvailabilityRule.pilot_profile_id.in_(pilot_ids),
+        AvailabilityRule.weekdays.op('&')(weekday_mask) != 0,
+        AvailabilityRule.valid_from <= max(days),
+        db.or_(AvailabilityRule.valid_until.is_(None), AvailabilityRule.valid_until >= min(days))
+    )
+    if start is not None and end is not None:
+        slots = slots.filter(AvailabilitySlot.start_time < end, AvailabilitySlot.end_time > start)
+        rules = rules.filter(AvailabilityRule.start_time < end, AvailabilityRule.end_time > start)
+    
+    intervals = {}
+    for pilot_id, day, slot_start, slot_end in slots:
+        intervals.setdefault(pilot_id, {}).setdefault(day, []).append((to_minutes(slot_start), to_minutes(slot_end)))
+    for rule in rules:
+        exception_dates = rule.exception_dates()
+        interval = (to_minutes(rule.start_time), to_minutes(rule.end_time))
+        for day in days:
+            if rule.occurs_on(day, exception_dates):
+                intervals.setdefault(rule.pilot_profile_id, {}).setdefault(day, []).append(interval)
+    
+    return {pilot_id: {day: merge_intervals(day_intervals) for day, day_intervals in by_day.items()}
+            for pilot_id, by_day in intervals.items()}
+
+def free_intervals_by_pilot(pilot_ids, day, start=None, end=None):
+    """Devuelve {pilot_id: [(inicio, fin)]} en minutos: disponibilidad del día menos reservas firmes.
+    
+    Con start/end (datetime.time) solo se leen los huecos y reservas que tocan esa ventana.
+    """
+    pilot_ids = list(pilot_ids)
+    if not pilot_ids:
+        return {}
+    
+    bookings = db.session.query(Booking.pilot_profile_id, Booking.start_time, Booking.end_time).filter(
+        Booking.pilot_profile_id.in_(pilot_ids),
+        Booking.booking_date == day,
+        Booking.status.in_(BLOCKING_BOOKING_STATUSES)
+    )
+    if start is not None and end is not None:
+        bookings = bookings.filter(Booking.start_time < end, Booking.end_time > start)
+    
+    busy = {}
+    for pilot_id, booking_start, booking_end in bookings:
+        busy.setdefault(pilot_id, []).append((to_minutes(booking_start), to_minutes(booking_end)))
+    
+    availability = availability_intervals(pilot_ids, [day], start, end)
+    return {pilot_id: subtract_intervals(by_day.get(day, []), busy.get(pilot_id, []))
+            for pilot_id, by_day in availability.items()}
+
+# Máximo de huecos por llamada a la comprobación en bloque
+SLOT_CHECK_MAX = 100
+
+def load_pilot_agendas(pilot_id, days):
+    """Devuelve ({día: DayAgenda de reservas activas}, {día: huecos unidos}) con tres consultas.
+    
+    Las reservas pendientes también entran en la agenda: no bloquean, pero se avisa del solape.
+    """
+    days = set(days)
+    agendas = {day: DayAgenda() for day in days}
+    
+    bookings = db.session.query(
+        Booking.id, Booking.status, Booking.booking_date, Booking.start_time, Booking.end_time
+    ).filter(
+        Booking.pilot_profile_id == pilot_id,
+        Booking.booking_date.in_(days),
+        Booking.status.in_(BLOCKING_BOOKING_STATUSES + ('pending',))
+    )
+    for booking_id, status, day, start_time, end_time in bookings:
+        agendas[day].add(to_minutes(start_time), to_minutes(end_time), (booking_id, status))
+    
+    by_day = availability_intervals([pilot_id], days).get(pilot_id, {})
+    return agendas, {day: by_day.get(day, []) for day in days}
+
+def lock_pilot_schedule(pilot_profile_id):
+    """Bloquea la agenda del piloto hasta el commit para que comprobar y escribir sea atómico.
+    
+    En SQLite, BEGIN IMMEDIATE toma el bloqueo de escritura antes de leer (debe ser lo
+    primero que escribe la sesión); en otros motores, SELECT ... FOR UPDATE del perfil.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text('BEGIN IMMEDIATE'))
+    else:
+        db.session.query(PilotProfile.id).filter_by(id=pilot_profile_id).with_for_update().one()
+
+def check_booking_slot(agendas, availability, day, start_time, end_time, exclude_booking_id=None):
+    """Resultado de comprobar un hueco contra la agenda cargada con load_pilot_agendas().
+    
+    exclude_booking_id: la propia reserva cuando se comprueba una que ya existe.
+    """
+    start, end = to_minutes(start_time), to_minutes(end_time)
+    overlaps = [(bid, status) for bid, status in agendas[day].overlapping(start, end) if bid != exclude_booking_id]
+    slots = availability[day]
+    return {
+        "available": not any(status in BLOCKING_BOOKING_STATUSES for _, status in overlaps),
+        "conflicting_booking_ids": [bid for bid, status in overlaps if status in BLOCKING_BOOKING_STATUSES],
+        "pending_booking_ids": [bid for bid, status in overlaps if status == 'pending'],
+        # None si el piloto no ha publicado disponibilidad ese día
+        "within_availability": covers(slots, start, end) if slots else None
+    }
+
+# --- FUNCIONES HELPER PARA NOTIFICACIONES ---
+# Notificaciones y emails se encolan con queue_notification/queue_email (ver la cola de trabajos)
+mailer = mailer_from_env()
+
+# --- COLA DE TRABAJOS (OUTBOX) ---
+# Espera antes de reintentar: JOB_BACKOFF_SECONDS * 2^(intentos - 1), como mucho JOB_BACKOFF_MAX_SECONDS
+JOB_BACKOFF_SECONDS = int(os.environ.get('JOB_BACKOFF_SECONDS', 10))
+JOB_BACKOFF_MAX_SECONDS = int(os.environ.get('JOB_BACKOFF_MAX_SECONDS', 3600))
+# Un trabajo "running" más antiguo que esto se da por abandonado (worker caído) y se reintenta
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 600))
+# Los emails esperan unos segundos antes de enviarse y, al reclamarlos, arrastran los demás emails
+# pendientes del mismo destinatario: una ráfaga de eventos sale en un único email
+EMAIL_COALESCE_SECONDS = int(os.environ.get('EMAIL_COALESCE_SECONDS', 30))
+JOB_HANDLERS = {}
+# Handlers que reciben todos los trabajos de su tipo de una vuelta y devuelven un error (o None) por trabajo
+JOB_BATCH_HANDLERS = {}
+
+def job_handler(job_type, batch=False):
+    def register(f):
+        (JOB_BATCH_HANDLERS if batch else JOB_HANDLERS)[job_type] = f
+        return f
+    return register
+
+def enqueue_job(job_type, delay_seconds=0, coalesce_key=None, **payload):
+    """Añade un trabajo a la sesión actual; se confirma (o se descarta) con el commit de la ruta"""
+    job = Job(
+        job_type=job_type,
+        payload=json.dumps(payload, ensure_ascii=False),
+        run_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+        coalesce_key=coalesce_key
+    )
+    db.session.add(job)
+    return job
+
+def queue_notification(user_id, notification_type, title, message, link=None, related_id=None):
+    return enqueue_job('notification', user_id=user_id, notification_type=notification_type,
+                       title=title, message=message, link=link, related_id=related_id)
+
+def queue_email(to_email, template, **context):
+    """Encola un email con una plantilla de mailer.EMAIL_TEMPLATES; se renderiza en el worker"""
+    return enqueue_job('email', delay_seconds=EMAIL_COALESCE_SECONDS, coalesce_key=to_email,
+                       to_email=to_email, template=template, context=context)
+
+@job_handler('notification')
+def handle_notification_job(payload):
+    # Sin commit: el worker confirma la notificación junto con el estado del trabajo
+    db.session.add(Notification(**payload))
+
+@job_handler('email', batch=True)
+def handle_email_jobs(payloads):
+    """Renderiza y envía todos los emails de la vuelta con una conexión SMTP, uno por destinatario"""
+    messages, errors = [], []
+    for payload in payloads:
+        try:
+            if 'template' in payload:
+                subject, html = render_email(payload['template'], payload['context'])
+            else:
+                subject, html = payload['subject'], payload['html_content']
+            messages.append((payload['to_email'], subject, html))
+            errors.append(None)
+        except KeyError as e:
+            errors.append(f"Plantilla o dato de email inválido: {e}")
+    
+    results = mailer.send_batch(messages)
+    return [error or results.get(payload['to_email'])
+            for payload, error in zip(payloads, errors)]
+
+def claim_jobs(limit):
+    """Marca como running hasta limit trabajos vencidos; el UPDATE condicional evita que dos workers cojan el mismo"""
+    now = datetime.utcnow()
+    due = db.or_(
+        db.and_(Job.status == 'pending', Job.run_at <= now),
+        db.and_(Job.status == 'running', Job.run_at <= now - timedelta(seconds=JOB_STALE_SECONDS))
+    )
+    candidates = db.session.query(Job.id).filter(due).order_by(Job.run_at, Job.id).limit(limit).all()
+    
+    claimed = []
+    for (job_id,) in candidates:
+        updated = Job.query.filter(Job.id == job_id, due).update(
+            {Job.status: 'running', Job.run_at: now}, synchronize_session=False
+        )
+        if updated:
+            claimed.append(job_id)
+    
+    # Con un trabajo agrupable se reclaman también sus hermanos aún no vencidos (sin reintentos
+    # pendientes), aunque sus run_at disten más que una vuelta del worker
+    groups = db.session.query(Job.job_type, Job.coalesce_key).filter(
+        Job.id.in_(claimed), Job.coalesce_key.isnot(None)
+    ).distinct().all() if claimed else []
+    for job_type, coalesce_key in groups:
+        sibling = db.and_(Job.job_type == job_type, Job.coalesce_key == coalesce_key,
+                          Job.status == 'pending', Job.attempts == 0)
+        for (job_id,) in db.session.query(Job.id).filter(sibling).all():
+            updated = Job.query.filter(Job.id == job_id, sibling).update(
+                {Job.status: 'running', Job.run_at: now}, synchronize_session=False
+            )
+            if updated:
+                claimed.append(job_id)
+    db.session.commit()
+    return Job.query.filter(Job.id.in_(claimed)).order_by(Job.id).all() if claimed else []
+
+def finish_job(job, error=None):
+    """Marca el trabajo como terminado o lo reprograma con backoff; no hace commit"""
+    job.attempts += 1
+    if error is None:
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+    elif job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+        job.last_error = str(error)[:1000]
+    else:
+        delay = min(JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1), JOB_BACKOFF_MAX_SECONDS)
+        job.status = 'pending'
+        job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+        job.last_error = str(error)[:1000]
+
+def run_job(job):
+    """Ejecuta un trabajo ya reclamado y guarda el resultado; devuelve True si terminó bien"""
     try:
-        print(f"""
-        ==================== EMAIL ====================
-        Para: {to_email}
-        Asunto: {subject}
-        Contenido:
-        {html_content}
-        ===============================================
-        """)
+        handler = JOB_HANDLERS.get(job.job_type)
+        if handler is None:
+            raise LookupError(f"Tipo de trabajo desconocido: {job.job_type}")
+        handler(json.loads(job.payload))
+        finish_job(job)
+        db.session.commit()
         return True
     except Exception as e:
-        print(f"Error enviando email: {e}")
+        # El rollback descarta también lo que hubiera añadido el handler
+        db.session.rollback()
+        finish_job(job, e)
+        db.session.commit()
         return False
+
+def run_job_batch(jobs):
+    """Ejecuta juntos trabajos del mismo tipo con su handler en lote; devuelve el nº de correctos"""
+    try:
+        errors = JOB_BATCH_HANDLERS[jobs[0].job_type]([json.loads(job.payload) for job in jobs])
+    except Exception as e:
+        db.session.rollback()
+        errors = [e] * len(jobs)
+    for job, error in zip(jobs, errors):
+        finish_job(job, error)
+    db.session.commit()
+    return sum(1 for error in errors if error is None)
+
+def run_pending_jobs(batch_size=50):
+    """Procesa un lote de trabajos vencidos; devuelve (correctos, fallidos)"""
+    ok = failed = 0
+    batches = {}
+    for job in claim_jobs(batch_size):
+        if job.job_type in JOB_BATCH_HANDLERS:
+            batches.setdefault(job.job_type, []).append(job)
+        elif run_job(job):
+            ok += 1
+        else:
+            failed += 1
+    for jobs in batches.values():
+        succeeded = run_job_batch(jobs)
+        ok += succeeded
+        failed += len(jobs) - succeeded
+    return ok, failed
+
+def process_jobs(interval=2.0, batch_size=50, once=False):
+    """Bucle del worker; con once=True termina cuando la cola queda vacía"""
+    while True:
+        with app.app_context():
+            try:
+                ok, failed = run_pending_jobs(batch_size)
+            except Exception as e:
+                print(f"Error procesando la cola de trabajos: {e}")
+                db.session.rollback()
+                ok = failed = 0
+        if ok or failed:
+            print(f"Trabajos procesados: {ok} correctos, {failed} con error")
+        elif once:
+            break
+        else:
+            time.sleep(interval)
+
+@app.cli.command("run-worker")
+@click.option('--once', is_flag=True, help="Procesa los trabajos pendientes y termina")
+@click.option('--interval', default=2.0, help="Segundos de espera cuando la cola está vacía")
+@click.option('--batch-size', default=50, help="Trabajos reclamados por vuelta")
+def run_worker_command(once, interval, batch_size):
+    """Worker de la cola de trabajos: flask --app backend_sqlite run-worker"""
+    print("👷 Worker de trabajos iniciado")
+    process_jobs(interval, batch_size, once)
+
+# JOB_WORKER=thread (por defecto): cada proceso web atiende la cola en un hilo, así las
+# notificaciones y emails salen sin desplegar nada más. JOB_WORKER=external cuando se
+# arranca aparte `flask --app backend_sqlite run-worker` (p. ej. un proceso worker: del Procfile).
+# claim_jobs reclama con un UPDATE condicional, así que varios procesos pueden convivir.
+JOB_WORKER = os.environ.get('JOB_WORKER', 'thread')
+_job_thread_started = False
+_job_thread_lock = threading.Lock()
+
+@app.before_request
+def start_job_thread():
+    # Se arranca con la primera petición (después del fork de gunicorn), no al importar el módulo
+    global _job_thread_started
+    if JOB_WORKER != 'thread' or _job_thread_started:
+        return
+    with _job_thread_lock:
+        if _job_thread_started:
+            return
+        _job_thread_started = True
+    threading.Thread(target=process_jobs, name='job-worker', daemon=True).start()
+
 # --- RUTAS PARA PAGOS ---
 @app.route('/api/create-payment-intent', methods=['POST'])
 def create_payment_intent():
@@ -509,7 +1523,7 @@ def confirm_payment():
             
             # ✅ NOTIFICACIÓN AL PILOTO: Pago recibido
             pilot_profile = PilotProfile.query.get(booking.pilot_profile_id)
-            create_notification(
+            queue_notification(
                 user_id=pilot_profile.user_id,
                 notification_type='payment',
                 title='💰 Pago recibido',
@@ -519,24 +1533,18 @@ def confirm_payment():
             )
             
             # ✅ EMAIL AL PILOTO
-            send_email_notification(
+            queue_email(
                 to_email=pilot_profile.user.email,
-                subject='Pago Recibido - DroneBook',
-                html_content=f'''
-                <h2>¡Has recibido un pago!</h2>
-                <p>Hola {pilot_profile.name},</p>
-                <p>El cliente <strong>{booking.client.username}</strong> ha completado el pago de:</p>
-                <ul>
-                    <li>Monto: <strong>€{payment.amount / 100:.2f}</strong></li>
-                    <li>Reserva: {booking.booking_date.strftime("%d/%m/%Y")}</li>
-                    <li>Servicio: {booking.job_description}</li>
-                </ul>
-                <p>El pago se procesará según los términos acordados.</p>
-                '''
+                template='payment_received',
+                pilot_name=pilot_profile.name,
+                client_name=booking.client.username,
+                amount=f"{payment.amount / 100:.2f}",
+                date=booking.booking_date.strftime("%d/%m/%Y"),
+                description=booking.job_description
             )
             
             # ✅ NOTIFICACIÓN AL CLIENTE: Confirmación de pago
-            create_notification(
+            queue_notification(
                 user_id=booking.client_id,
                 notification_type='payment',
                 title='✅ Pago confirmado',
@@ -591,47 +1599,150 @@ def get_nearby_pilots():
         return jsonify({"error": "Coordenadas requeridas"}), 400
     
     try:
-        def calculate_distance(lat1, lon1, lat2, lon2):
-            R = 6371
-            lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-            c = 2 * atan2(sqrt(a), sqrt(1-a))
-            return R * c
-        
-        profiles = PilotProfile.query.filter(
-            PilotProfile.latitude.isnot(None),
-            PilotProfile.longitude.isnot(None)
-        ).all()
+        in_radius = find_pilots_within(float(user_lat), float(user_lng), float(radius_km))
         
         nearby_pilots = []
-        for profile in profiles:
-            distance = calculate_distance(
-                float(user_lat), float(user_lng),
-                float(profile.latitude), float(profile.longitude)
-            )
-            
-            if distance <= radius_km:
-                reviews = Review.query.filter_by(pilot_profile_id=profile.id).all()
-                total_reviews = len(reviews)
-                average_rating = sum(r.rating for r in reviews) / total_reviews if total_reviews > 0 else 0
-                
-                pilot_dict = profile.to_dict()
-                pilot_dict.update({
-                    "distance": round(distance, 1),
-                    "total_reviews": total_reviews,
-                    "average_rating": round(average_rating, 1)
-                })
-                nearby_pilots.append(pilot_dict)
+        pilot_dicts = pilots_to_dicts([profile for profile, _ in in_radius])
+        for (profile, distance), pilot_dict in zip(in_radius, pilot_dicts):
+            pilot_dict.update(profile.rating_stats())
+            pilot_dict["distance"] = round(distance, 1)
+            nearby_pilots.append(pilot_dict)
         
-        nearby_pilots.sort(key=lambda x: x['distance'])
         return jsonify(nearby_pilots)
         
     except Exception as e:
         return jsonify({"error": f"Error calculando pilotos cercanos: {str(e)}"}), 500
 
+@app.route("/api/pilots/nearest", methods=['GET'])
+def get_nearest_pilots():
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    k = request.args.get('k', default=10, type=int)
+    
+    if lat is None or lng is None:
+        return jsonify({"error": "Coordenadas requeridas"}), 400
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return jsonify({"error": "Coordenadas fuera de rango"}), 400
+    k = max(1, min(k, 100))
+    
+    try:
+        nearest = ensure_spatial_index().nearest(lat, lng, k)
+        profiles = {p.id: p for p in PilotProfile.query.filter(
+            PilotProfile.id.in_([pid for pid, _ in nearest])
+        ).all()}
+        ordered = [(profiles[pid], distance) for pid, distance in nearest if pid in profiles]
+        
+        pilots = []
+        for (profile, distance), pilot_dict in zip(ordered, pilots_to_dicts([p for p, _ in ordered])):
+            pilot_dict.update(profile.rating_stats())
+            pilot_dict["distance"] = round(distance, 1)
+            pilots.append(pilot_dict)
+        
+        return jsonify(pilots)
+    except Exception as e:
+        return jsonify({"error": f"Error calculando pilotos más cercanos: {str(e)}"}), 500
+
 # --- RUTAS PARA CHAT ---
+# Cada conexión SSE se cierra tras CHAT_STREAM_MAX_SECONDS; EventSource reconecta solo.
+# Solo con CHAT_BROKER y workers concurrentes (gthread/gevent): con workers síncronos un stream bloquea el worker
+CHAT_STREAM_MAX_SECONDS = int(os.environ.get('CHAT_STREAM_MAX_SECONDS', 300))
+CHAT_STREAM_HEARTBEAT_SECONDS = 15
+MESSAGES_PAGE_MAX = 200
+MESSAGE_PREVIEW_CHARS = 200  # longitud de Conversation.last_message_preview
+chat_broker = broker_from_env()
+
+def set_last_message(conversation, message):
+    conversation.last_message_at = message.created_at or datetime.utcnow()
+    conversation.last_message_preview = message.content[:MESSAGE_PREVIEW_CHARS]
+    conversation.last_message_sender = message.sender_type
+    conversation.last_message_id = message.id
+
+def rebuild_conversation_summaries():
+    """Recalcula contadores de no leídos y último mensaje de todas las conversaciones en dos consultas"""
+    rows = db.session.query(
+        Message.conversation_id, Message.sender_type, db.func.count(Message.id)
+    ).filter(Message.is_read == False).group_by(Message.conversation_id, Message.sender_type).all()
+    counts = {(conversation_id, sender_type): count for conversation_id, sender_type, count in rows}
+    
+    last_ids = db.session.query(
+        Message.conversation_id, db.func.max(Message.id).label('message_id')
+    ).group_by(Message.conversation_id).subquery()
+    last_messages = {
+        msg.conversation_id: msg
+        for msg in Message.query.join(last_ids, Message.id == last_ids.c.message_id).all()
+    }
+    
+    updated = 0
+    for conversation in Conversation.query.all():
+        # Lo pendiente del cliente son los mensajes del piloto y viceversa
+        conversation.client_unread = counts.get((conversation.id, 'pilot'), 0)
+        conversation.pilot_unread = counts.get((conversation.id, 'client'), 0)
+        last_message = last_messages.get(conversation.id)
+        if last_message:
+            set_last_message(conversation, last_message)
+        else:
+            conversation.last_message_preview = None
+            conversation.last_message_sender = None
+            conversation.last_message_id = None
+        updated += 1
+    
+    db.session.commit()
+    return updated
+
+# Bases de datos anteriores a los contadores o al resumen del último mensaje:
+# migrate_schema() añade las columnas vacías y aquí se rellenan
+SCHEMA_BACKFILLS.append(("conversation.client_unread", rebuild_conversation_summaries))
+SCHEMA_BACKFILLS.append(("conversation.last_message_preview", rebuild_conversation_summaries))
+SCHEMA_BACKFILLS.append(("conversation.last_message_id", rebuild_conversation_summaries))
+
+@app.cli.command("rebuild-conversations")
+def rebuild_conversations_command():
+    """Recalcula no leídos y último mensaje: flask --app backend_sqlite rebuild-conversations"""
+    updated = rebuild_conversation_summaries()
+    print(f"✅ Resúmenes recalculados para {updated} conversaciones")
+
+def publish_chat_event(user_ids, event, data):
+    """Envía un evento a las conexiones de chat abiertas de esos usuarios (después del commit)"""
+    if chat_broker is None:
+        return
+    for user_id in set(user_ids):
+        try:
+            chat_broker.publish(f"user:{user_id}", {"event": event, "data": data})
+        except Exception as e:
+            print(f"Error publicando evento de chat: {e}")
+
+@app.route('/api/chat/stream', methods=['GET'])
+def chat_stream():
+    """Canal SSE con los mensajes nuevos ("message") y confirmaciones de lectura ("read") del usuario"""
+    if chat_broker is None:
+        # Push desactivado (CHAT_BROKER sin configurar o varios workers sin Redis): el cliente vuelve al sondeo
+        return jsonify({"error": "Canal de chat en tiempo real no disponible"}), 503
+    
+    user = User.query.filter_by(email=request.args.get('email')).first()
+    if not user:
+        return jsonify({"error": "Usuario no encontrado"}), 404
+    
+    subscription = chat_broker.subscribe(f"user:{user.id}")
+    
+    def events():
+        deadline = time.monotonic() + CHAT_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                item = subscription.get(timeout=CHAT_STREAM_HEARTBEAT_SECONDS)
+                if item is None:
+                    # Comentario SSE para que proxies y navegador no corten la conexión
+                    yield ": keepalive\n\n"
+                else:
+                    yield sse_event(item["event"], item["data"])
+        finally:
+            subscription.close()
+    
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
     email = request.args.get('email')
@@ -644,12 +1755,16 @@ def get_conversations():
     
     conversations = []
     
+    # Una consulta: el resumen del último mensaje vive en Conversation y los participantes van en el JOIN
+    inbox = Conversation.query.options(
+        db.joinedload(Conversation.client), db.joinedload(Conversation.pilot_profile)
+    ).order_by(Conversation.last_message_at.desc())
     if user.role == 'Cliente':
-        convs = Conversation.query.filter_by(client_id=user.id).order_by(Conversation.last_message_at.desc()).all()
-        conversations = [conv.to_dict() for conv in convs]
+        convs = inbox.filter(Conversation.client_id == user.id).all()
+        conversations = [conv.to_dict('client') for conv in convs]
     elif user.role == 'Piloto' and user.pilot_profile:
-        convs = Conversation.query.filter_by(pilot_profile_id=user.pilot_profile.id).order_by(Conversation.last_message_at.desc()).all()
-        conversations = [conv.to_dict() for conv in convs]
+        convs = inbox.filter(Conversation.pilot_profile_id == user.pilot_profile.id).all()
+        conversations = [conv.to_dict('pilot') for conv in convs]
     
     return jsonify(conversations)
 
@@ -674,7 +1789,7 @@ def start_conversation():
     if existing_conv:
         return jsonify({
             "message": "Conversación encontrada",
-            "conversation": existing_conv.to_dict()
+            "conversation": existing_conv.to_dict('client')
         })
     
     new_conversation = Conversation(
@@ -687,7 +1802,7 @@ def start_conversation():
     
     return jsonify({
         "message": "Conversación creada",
-        "conversation": new_conversation.to_dict()
+        "conversation": new_conversation.to_dict('client')
     }), 201
 
 @app.route('/api/conversations/<int:conversation_id>/messages', methods=['GET'])
@@ -710,20 +1825,78 @@ def get_messages(conversation_id):
     
     if not has_access:
         return jsonify({"error": "No autorizado"}), 403
-    
-    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.created_at.asc()).all()
-    
-    unread_messages = [msg for msg in messages if not msg.is_read and msg.sender_id != user.id]
-    for msg in unread_messages:
-        msg.is_read = True
-    
-    if unread_messages:
+    reader_type = 'client' if conversation.client_id == user.id else 'pilot'
+    
+    # Se marca como leído antes de cargar la página para que los mensajes salgan ya actualizados.
+    # Si la marca de lectura está al día (refrescos, sondeos) no se escribe nada.
+    watermark_attr = f'{reader_type}_last_read_id'
+    read_from = getattr(conversation, watermark_attr) or 0
+    read_up_to = conversation.last_message_id
+    if read_up_to is None:
+        # Sin mensajes o con el resumen aún sin recalcular: se consulta el historial para no dejar nada sin marcar
+        read_up_to = db.session.query(db.func.max(Message.id)).filter(
+            Message.conversation_id == conversation_id
+        ).scalar() or 0
+    if read_up_to > read_from:
+        # Un único UPDATE sobre el rango nuevo que solo toca filas realmente sin leer
+        marked = Message.query.filter(
+            Message.conversation_id == conversation_id,
+            Message.id > read_from,
+            Message.id <= read_up_to,
+            Message.sender_type != reader_type,
+            Message.is_read == False
+        ).update({Message.is_read: True}, synchronize_session=False)
+        setattr(conversation, watermark_attr, read_up_to)
+        if marked:
+            unread_column = getattr(Conversation, f'{reader_type}_unread')
+            setattr(conversation, f'{reader_type}_unread',
+                    db.case((unread_column > marked, unread_column - marked), else_=0))
         db.session.commit()
+        
+        if marked:
+            other_user_id = conversation.pilot_profile.user_id if reader_type == 'client' else conversation.client_id
+            publish_chat_event([other_user_id], 'read', {
+                "conversation_id": conversation_id,
+                "reader_type": reader_type,
+                "last_read_id": read_up_to
+            })
+    
+    # after_id: solo los mensajes nuevos (sincronización incremental, orden ascendente)
+    # before_id/limit: los últimos mensajes anteriores a before_id (scroll hacia atrás)
+    # Con limit, X-Next-Cursor indica que quedan más: es el after_id o before_id de la siguiente página
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+    next_cursor = None
+    if after_id is not None:
+        query = query.filter(Message.id > after_id).order_by(Message.id.asc())
+        messages = query.limit(limit + 1).all() if limit else query.all()
+        if limit and len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = messages[-1].id
+    elif before_id is not None or limit is not None:
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        query = query.order_by(Message.id.desc())
+        messages = query.limit(limit + 1).all() if limit else query.all()
+        if limit and len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = messages[-1].id
+        messages.reverse()
+    else:
+        messages = query.order_by(Message.id.asc()).all()
     
-    return jsonify({
-        "conversation": conversation.to_dict(),
-        "messages": [msg.to_dict() for msg in messages]
+    response = jsonify({
+        "conversation": conversation.to_dict(reader_type),
+        "messages": messages_to_dicts(conversation, messages)
     })
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
 
 @app.route('/api/conversations/<int:conversation_id>/messages', methods=['POST'])
 def send_message(conversation_id):
@@ -758,17 +1931,26 @@ def send_message(conversation_id):
         content=content,
         sender_type=sender_type,
         sender_id=user.id,
-        conversation_id=conversation_id
+        conversation_id=conversation_id,
+        created_at=datetime.utcnow()
     )
     
-    conversation.last_message_at = datetime.utcnow()
-    
     db.session.add(message)
-    db.session.commit()
+    db.session.flush()
+    # Si el remitente estaba al día, su propio mensaje no le deja nada pendiente de leer
+    sender_watermark = f'{sender_type}_last_read_id'
+    if getattr(conversation, sender_watermark) == conversation.last_message_id:
+        setattr(conversation, sender_watermark, message.id)
+    set_last_message(conversation, message)
+    # Incremento en SQL (sin leer-modificar-escribir) dentro de la misma transacción que el mensaje
+    if sender_type == 'client':
+        conversation.pilot_unread = Conversation.pilot_unread + 1
+    else:
+        conversation.client_unread = Conversation.client_unread + 1
     
     # ✅ NOTIFICACIÓN AL RECEPTOR: Nuevo mensaje
     sender_name = user.username if sender_type == 'client' else user.pilot_profile.name
-    create_notification(
+    queue_notification(
         user_id=recipient_id,
         notification_type='message',
         title='💬 Nuevo mensaje',
@@ -776,10 +1958,14 @@ def send_message(conversation_id):
         link=f'/chat/{conversation_id}',
         related_id=conversation_id
     )
+    db.session.commit()
+    
+    message_dict = messages_to_dicts(conversation, [message])[0]
+    publish_chat_event([conversation.client_id, conversation.pilot_profile.user_id], 'message', message_dict)
     
     return jsonify({
         "message": "Mensaje enviado",
-        "data": message.to_dict()
+        "data": message_dict
     }), 201
 @app.route('/api/chat/unread-count', methods=['GET'])
 def get_unread_count():
@@ -792,21 +1978,13 @@ def get_unread_count():
     unread_count = 0
     
     if user.role == 'Cliente':
-        conversations = Conversation.query.filter_by(client_id=user.id).all()
-        for conv in conversations:
-            unread_count += Message.query.filter_by(
-                conversation_id=conv.id,
-                sender_type='pilot',
-                is_read=False
-            ).count()
+        unread_count = db.session.query(db.func.coalesce(db.func.sum(Conversation.client_unread), 0)).filter(
+            Conversation.client_id == user.id
+        ).scalar()
     elif user.role == 'Piloto' and user.pilot_profile:
-        conversations = Conversation.query.filter_by(pilot_profile_id=user.pilot_profile.id).all()
-        for conv in conversations:
-            unread_count += Message.query.filter_by(
-                conversation_id=conv.id,
-                sender_type='client',
-                is_read=False
-            ).count()
+        unread_count = db.session.query(db.func.coalesce(db.func.sum(Conversation.pilot_unread), 0)).filter(
+            Conversation.pilot_profile_id == user.pilot_profile.id
+        ).scalar()
     
     return jsonify({"unread_count": unread_count})
 
@@ -815,32 +1993,250 @@ def get_unread_count():
 def uploaded_file(filename):
     return send_from_directory(os.path.join(app.instance_path, 'static', 'uploads'), filename)
 
+PILOT_SUMMARY_FIELDS = (
+    "id", "name", "tagline", "location", "hourly_rate", "profilePictureUrl",
+    "total_reviews", "average_rating", "is_verified"
+)
+PILOTS_PAGE_MAX = 100
+PILOTS_PAGE_DEFAULT = 50  # sin limit también se pagina: nunca se devuelve el catálogo entero
+
+def pilots_to_summaries(profiles):
+    """Vista resumida para tarjetas: no carga relaciones hijas, solo una consulta para is_verified"""
+    ids = [p.id for p in profiles]
+    verified_ids = set()
+    if ids:
+        verified_ids = {
+            row[0] for row in db.session.query(Certification.pilot_profile_id).filter(
+                Certification.pilot_profile_id.in_(ids),
+                Certification.verification_status == 'verified'
+            ).distinct()
+        }
+    
+    summaries = []
+    for profile in profiles:
+        summary = {
+            "id": profile.id, "name": profile.name, "tagline": profile.tagline,
+            "location": profile.location, "hourly_rate": profile.hourly_rate,
+            "profilePictureUrl": f"https://picsum.photos/seed/{profile.id}/300/300",
+            "is_verified": profile.id in verified_ids
+        }
+        summary.update(profile.rating_stats())
+        summaries.append(summary)
+    return summaries
+
 @app.route("/api/pilots")
+@catalog_cached
 def get_pilots_with_reviews():
-    profiles = PilotProfile.query.all()
-    pilots_with_reviews = []
+    view = request.args.get('view', 'full')
+    if view not in ('summary', 'full'):
+        return jsonify({"error": "Vista inválida (summary o full)"}), 400
     
-    for profile in profiles:
-        reviews = Review.query.filter_by(pilot_profile_id=profile.id).all()
-        total_reviews = len(reviews)
-        average_rating = sum(r.rating for r in reviews) / total_reviews if total_reviews > 0 else 0
-        
-        pilot_dict = profile.to_dict()
-        pilot_dict.update({
-            "total_reviews": total_reviews,
-            "average_rating": round(average_rating, 1)
-        })
-        pilots_with_reviews.append(pilot_dict)
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    if fields and all(f in PILOT_SUMMARY_FIELDS for f in fields):
+        view = 'summary'
+    
+    query = PilotProfile.query.order_by(PilotProfile.id.asc())
     
-    return jsonify(pilots_with_reviews)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            query = query.filter(PilotProfile.id > int(cursor))
+        except ValueError:
+            return jsonify({"error": "Cursor inválido"}), 400
+    
+    limit = max(1, min(request.args.get('limit', PILOTS_PAGE_DEFAULT, type=int), PILOTS_PAGE_MAX))
+    # Se pide uno más para saber si hay página siguiente sin un COUNT
+    profiles = query.limit(limit + 1).all()
+    has_more = len(profiles) > limit
+    profiles = profiles[:limit]
+    
+    if view == 'summary':
+        pilots_with_reviews = pilots_to_summaries(profiles)
+    else:
+        pilots_with_reviews = []
+        for profile, pilot_dict in zip(profiles, pilots_to_dicts(profiles)):
+            pilot_dict.update(profile.rating_stats())
+            pilots_with_reviews.append(pilot_dict)
+    
+    if fields:
+        pilots_with_reviews = [
+            {f: pilot[f] for f in fields if f in pilot} for pilot in pilots_with_reviews
+        ]
+    
+    response = jsonify(pilots_with_reviews)
+    if has_more:
+        response.headers['X-Next-Cursor'] = str(profiles[-1].id)
+    return response
 
 @app.route("/api/pilots/<int:profile_id>")
+@catalog_cached
 def get_pilot_details(profile_id):
     profile = PilotProfile.query.get(profile_id)
     if not profile:
         return jsonify({"error": "Perfil no encontrado"}), 404
     return jsonify(profile.to_dict())
 
+def filter_indexed_pilots(facts, ids, filters):
+    """Aplica precio, badges, verificación, valoración y distancia sobre los datos del índice.
+    
+    Devuelve {pilot_id: distancia_km o None} de los pilotos que pasan todos los filtros.
+    """
+    ids = [pid for pid in ids if pid in facts]
+    if not ids:
+        return {}
+    
+    keep = np.ones(len(ids), dtype=bool)
+    if filters.get("min_price") is not None or filters.get("max_price") is not None:
+        prices = np.array([facts[pid]["from_price"] for pid in ids], dtype=np.float64)
+        if filters.get("min_price") is not None:
+            keep &= prices >= filters["min_price"]
+        if filters.get("max_price") is not None:
+            keep &= prices <= filters["max_price"]
+    if filters.get("min_rating") is not None:
+        ratings = np.array([facts[pid]["average_rating"] for pid in ids], dtype=np.float64)
+        keep &= ratings >= filters["min_rating"]
+    if filters.get("verified") is not None:
+        verified = np.array([facts[pid]["is_verified"] for pid in ids], dtype=bool)
+        keep &= verified == filters["verified"]
+    if filters.get("badge_types"):
+        wanted = set(filters["badge_types"])
+        keep &= np.array([bool(facts[pid]["badge_types"] & wanted) for pid in ids], dtype=bool)
+    
+    distances = [None] * len(ids)
+    if filters.get("lat") is not None and filters.get("lng") is not None:
+        lats = np.array([facts[pid]["latitude"] if facts[pid]["latitude"] is not None else np.nan for pid in ids])
+        lngs = np.array([facts[pid]["longitude"] if facts[pid]["longitude"] is not None else np.nan for pid in ids])
+        km = haversine_km(filters["lat"], filters["lng"], lats, lngs)
+        # Los pilotos sin coordenadas dan NaN y quedan fuera
+        keep &= km <= filters["radius_km"]
+        distances = km.tolist()
+    
+    return {pid: distances[i] for i, pid in enumerate(ids) if keep[i]}
+
+@app.route("/api/pilots/facets", methods=['GET'])
+@catalog_cached
+def get_pilot_facets():
+    """Recuentos por badge, ciudad, tramo de precio y verificación.
+    
+    Acepta los filtros activos como badge_type, city, price y verified
+    (listas separadas por comas) y devuelve los recuentos cruzados con ellos.
+    """
+    filters = {
+        facet: [v.strip() for v in request.args.get(facet, '').split(',') if v.strip()]
+        for facet in ('badge_type', 'city', 'price', 'verified')
+    }
+    
+    try:
+        total, counts = ensure_facet_index().counts(filters)
+        # Los tramos de precio se devuelven siempre y en orden, aunque estén vacíos
+        counts["price"] = {label: counts["price"].get(label, 0) for label, _, _ in PRICE_BUCKETS}
+        return jsonify({"total": total, "filters": filters, "facets": counts})
+    except Exception as e:
+        return jsonify({"error": f"Error calculando facetas: {str(e)}"}), 500
+
+@app.route("/api/pilots/available", methods=['GET'])
+def get_available_pilots():
+    """Pilotos libres en una ventana: ?date=YYYY-MM-DD&start=HH:MM&end=HH:MM
+    
+    Opcionales: lat, lng y radius_km para limitar por distancia, max_price y limit.
+    """
+    args = request.args
+    try:
+        day = datetime.strptime(args.get('date'), '%Y-%m-%d').date()
+        start_time = datetime.strptime(args.get('start'), '%H:%M').time()
+        end_time = datetime.strptime(args.get('end'), '%H:%M').time()
+    except (ValueError, TypeError):
+        return jsonify({"error": "Formato de fecha/hora inválido"}), 400
+    if start_time >= end_time:
+        return jsonify({"error": "La hora de inicio debe ser anterior a la de fin"}), 400
+    
+    lat = args.get('lat', type=float)
+    lng = args.get('lng', type=float)
+    if (lat is None) != (lng is None):
+        return jsonify({"error": "Se necesitan lat y lng para filtrar por distancia"}), 400
+    radius_km = args.get('radius_km', default=25, type=float)
+    max_price = args.get('max_price', type=int)
+    limit = max(1, min(args.get('limit', default=50, type=int), PILOTS_PAGE_MAX))
+    
+    try:
+        # Primero los pilotos con algún hueco o regla que toque la ventana (índice pilot_profile_id, date)
+        query = _filtered_pilots_query({"budget": max_price}, ["budget"] if max_price is not None else [])
+        query = query.filter(available_pilots_filter(day, start_time, end_time))
+        if lat is not None:
+            candidates = find_pilots_within(lat, lng, radius_km, query)
+        else:
+            average = db.func.coalesce(PilotProfile.rating_sum * 1.0 / db.func.nullif(PilotProfile.rating_count, 0), 0)
+            candidates = [(p, None) for p in query.order_by(average.desc(), PilotProfile.id).all()]
+        
+        # Después se descuentan las reservas firmes y se exige la ventana completa
+        free = free_intervals_by_pilot([p.id for p, _ in candidates], day, start_time, end_time)
+        window = (to_minutes(start_time), to_minutes(end_time))
+        available = [(p, d) for p, d in candidates if covers(free.get(p.id, []), *window)][:limit]
+        
+        results = []
+        for (profile, distance), summary in zip(available, pilots_to_summaries([p for p, _ in available])):
+            summary["distance"] = round(distance, 1) if distance is not None else None
+            summary["free_intervals"] = [
+                {"start": format_minutes(s), "end": format_minutes(e)} for s, e in free[profile.id]
+            ]
+            results.append(summary)
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": f"Error buscando pilotos disponibles: {str(e)}"}), 500
+
+@app.route("/api/pilots/search", methods=['GET'])
+def search_pilots_instant():
+    """Búsqueda sin IA para el buscador mientras se escribe.
+    
+    Parámetros: q, min_price, max_price, badge (lista separada por comas),
+    verified, min_rating, lat, lng, radius_km y limit.
+    """
+    args = request.args
+    filters = {
+        "min_price": args.get('min_price', type=float),
+        "max_price": args.get('max_price', type=float),
+        "min_rating": args.get('min_rating', type=float),
+        "badge_types": [b.strip() for b in args.get('badge', '').split(',') if b.strip()],
+        "lat": args.get('lat', type=float),
+        "lng": args.get('lng', type=float),
+        "radius_km": args.get('radius_km', default=25, type=float),
+    }
+    verified = args.get('verified')
+    if verified is not None:
+        if verified.lower() not in ('true', 'false', '1', '0'):
+            return jsonify({"error": "verified debe ser true o false"}), 400
+        filters["verified"] = verified.lower() in ('true', '1')
+    if (filters["lat"] is None) != (filters["lng"] is None):
+        return jsonify({"error": "Se necesitan lat y lng para filtrar por distancia"}), 400
+    limit = max(1, min(args.get('limit', default=20, type=int), PILOTS_PAGE_MAX))
+    query_text = args.get('q', '')
+    
+    try:
+        index = ensure_text_index()
+        facts = index.facts()
+        if query_text.strip():
+            scores = index.search(query_text)
+            matches = filter_indexed_pilots(facts, scores.keys(), filters)
+            ranked = sorted(matches, key=lambda pid: (-scores[pid], -facts[pid]["average_rating"], pid))
+        else:
+            scores = {}
+            matches = filter_indexed_pilots(facts, facts.keys(), filters)
+            ranked = sorted(matches, key=lambda pid: (-facts[pid]["average_rating"], -facts[pid]["rating_count"], pid))
+        ranked = ranked[:limit]
+        
+        profiles = {p.id: p for p in PilotProfile.query.filter(PilotProfile.id.in_(ranked)).all()}
+        ordered = [profiles[pid] for pid in ranked if pid in profiles]
+        results = []
+        for profile, summary in zip(ordered, pilots_to_summaries(ordered)):
+            distance = matches[profile.id]
+            summary["score"] = round(scores.get(profile.id, 0.0), 3)
+            summary["distance"] = round(distance, 1) if distance is not None else None
+            results.append(summary)
+        
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": f"Error en la búsqueda de pilotos: {str(e)}"}), 500
+
 @app.route("/api/register", methods=['POST'])
 def register():
     data = request.get_json()
@@ -864,7 +2260,9 @@ def register():
     if new_user.role == 'Piloto':
         profile = PilotProfile(name=new_user.username, user_id=new_user.id)
         db.session.add(profile)
+        version_before = bump_catalog_version()
         db.session.commit()
+        sync_catalog_indexes(profile.id, version_before)
     
     return jsonify({"message": "Usuario creado con éxito"}), 201
 
@@ -908,30 +2306,14 @@ def handle_profile():
     profile.phone = data.get('phone', profile.phone)
     
     if data.get('location') and data.get('location') != old_location:
-        try:
-            sample_coordinates = {
-                "madrid": {"lat": 40.4168, "lng": -3.7038},
-                "barcelona": {"lat": 41.3851, "lng": 2.1734},
-                "valencia": {"lat": 39.4699, "lng": -0.3763},
-                "sevilla": {"lat": 37.3886, "lng": -5.9823},
-                "zaragoza": {"lat": 41.6488, "lng": -0.8891},
-                "málaga": {"lat": 36.7196, "lng": -4.4214},
-                "murcia": {"lat": 37.9922, "lng": -1.1307},
-                "palma": {"lat": 39.5696, "lng": 2.6502},
-                "bilbao": {"lat": 43.263, "lng": -2.9349},
-                "alicante": {"lat": 38.3452, "lng": -0.4810}
-            }
-            
-            location_lower = data.get('location').lower()
-            for city, coords in sample_coordinates.items():
-                if city in location_lower:
-                    profile.latitude = coords["lat"]
-                    profile.longitude = coords["lng"]
-                    break
-        except:
-            pass
+        place = geocode(data.get('location'))
+        if place:
+            profile.latitude = place["lat"]
+            profile.longitude = place["lng"]
     
+    version_before = bump_catalog_version()
     db.session.commit()
+    sync_catalog_indexes(profile.id, version_before)
     return jsonify({"message": "Perfil guardado"})
 
 @app.route("/api/book", methods=['POST'])
@@ -950,6 +2332,16 @@ def create_booking():
         end_time = datetime.strptime(data.get('end_time'), '%H:%M').time()
     except (ValueError, TypeError):
         return jsonify({"error": "Formato de fecha/hora inválido"}), 400
+    if start_time >= end_time:
+        return jsonify({"error": "La hora de inicio debe ser anterior a la de fin"}), 400
+    
+    agendas, availability = load_pilot_agendas(pilot.id, [booking_date])
+    schedule_check = check_booking_slot(agendas, availability, booking_date, start_time, end_time)
+    if not schedule_check["available"]:
+        return jsonify({
+            "error": "El piloto ya tiene una reserva confirmada en ese horario",
+            "schedule_check": schedule_check
+        }), 409
     
     duration_hours = (datetime.combine(booking_date, end_time) - 
                      datetime.combine(booking_date, start_time)).seconds // 3600
@@ -967,9 +2359,9 @@ def create_booking():
     )
     
     db.session.add(new_booking)
-    db.session.commit()
+    db.session.flush()
     
-    create_notification(
+    queue_notification(
         user_id=pilot.user_id,
         notification_type='booking',
         title='Nueva solicitud de reserva',
@@ -978,26 +2370,23 @@ def create_booking():
         related_id=new_booking.id
     )
     
-    send_email_notification(
+    queue_email(
         to_email=pilot.user.email,
-        subject='Nueva Reserva en DroneBook',
-        html_content=f'''
-        <h2>Nueva Solicitud de Reserva</h2>
-        <p>Hola {pilot.name},</p>
-        <p><strong>{client.username}</strong> ha solicitado una reserva:</p>
-        <ul>
-            <li>Fecha: {booking_date.strftime("%d/%m/%Y")}</li>
-            <li>Hora: {start_time.strftime("%H:%M")} - {end_time.strftime("%H:%M")}</li>
-            <li>Descripción: {data.get('job_description')}</li>
-            <li>Precio: €{total_price}</li>
-        </ul>
-        <p>Accede a DroneBook para aceptar o rechazar la reserva.</p>
-        '''
+        template='booking_request',
+        pilot_name=pilot.name,
+        client_name=client.username,
+        date=booking_date.strftime("%d/%m/%Y"),
+        start_time=start_time.strftime("%H:%M"),
+        end_time=end_time.strftime("%H:%M"),
+        description=data.get('job_description'),
+        price=total_price
     )
+    db.session.commit()
     
     return jsonify({
         "message": "Solicitud de reserva enviada",
-        "booking": new_booking.to_dict()
+        "booking": new_booking.to_dict(),
+        "schedule_check": schedule_check
     })
 
 @app.route("/api/bookings", methods=['GET'])
@@ -1007,13 +2396,20 @@ def get_bookings():
         return jsonify({"error": "Usuario no encontrado"}), 404
     
     if user.role == 'Cliente':
-        bookings = user.bookings_made
+        query = booking_rows_query().filter(Booking.client_id == user.id)
     elif user.role == 'Piloto' and user.pilot_profile:
-        bookings = user.pilot_profile.bookings_received
+        query = booking_rows_query().filter(Booking.pilot_profile_id == user.pilot_profile.id)
     else:
-        bookings = []
+        return jsonify([])
     
-    return jsonify([b.to_dict() for b in bookings])
+    return bookings_page_response(query)
+
+# Estado pedido -> estados desde los que se puede llegar a él
+BOOKING_RESPONSE_TRANSITIONS = {
+    'confirmed': {'pending'},
+    'rejected': {'pending'},
+    'completed': {'confirmed', 'paid'},
+}
 
 @app.route("/api/bookings/<int:booking_id>/respond", methods=['POST'])
 def respond_to_booking(booking_id):
@@ -1022,11 +2418,36 @@ def respond_to_booking(booking_id):
         return jsonify({"error": "Reserva no encontrada"}), 404
     
     new_status = request.json.get('status')
-    if new_status not in ['confirmed', 'rejected', 'completed']:
+    if new_status not in BOOKING_RESPONSE_TRANSITIONS:
         return jsonify({"error": "Estado inválido"}), 400
     
+    # Comprobación y cambio de estado en la misma transacción, con la agenda bloqueada: dos
+    # respuestas simultáneas (confirmar y rechazar, confirmar dos veces, dos reservas solapadas)
+    # no pueden pasar las dos
+    lock_pilot_schedule(booking.pilot_profile_id)
+    db.session.refresh(booking)
+    if booking.status not in BOOKING_RESPONSE_TRANSITIONS[new_status]:
+        current_status = booking.status
+        db.session.rollback()
+        return jsonify({
+            "error": f"La reserva ya está en estado {current_status}",
+            "status": current_status
+        }), 409
+    
+    if new_status == 'confirmed':
+        agendas, availability = load_pilot_agendas(booking.pilot_profile_id, [booking.booking_date])
+        schedule_check = check_booking_slot(
+            agendas, availability, booking.booking_date, booking.start_time, booking.end_time,
+            exclude_booking_id=booking.id
+        )
+        if not schedule_check["available"]:
+            db.session.rollback()
+            return jsonify({
+                "error": "Ya hay otra reserva confirmada que se solapa con esta",
+                "schedule_check": schedule_check
+            }), 409
+    
     booking.status = new_status
-    db.session.commit()
     
     status_messages = {
         'confirmed': 'ha aceptado',
@@ -1037,7 +2458,7 @@ def respond_to_booking(booking_id):
     pilot_profile = PilotProfile.query.get(booking.pilot_profile_id)
     client = User.query.get(booking.client_id)
     
-    create_notification(
+    queue_notification(
         user_id=booking.client_id,
         notification_type='booking',
         title=f'Actualización de reserva',
@@ -1046,23 +2467,60 @@ def respond_to_booking(booking_id):
         related_id=booking.id
     )
     
-    send_email_notification(
+    queue_email(
         to_email=client.email,
-        subject=f'Reserva {new_status.capitalize()} - DroneBook',
-        html_content=f'''
-        <h2>Estado de Reserva Actualizado</h2>
-        <p>Hola {client.username},</p>
-        <p><strong>{pilot_profile.name}</strong> {status_messages[new_status]} tu reserva:</p>
-        <ul>
-            <li>Fecha: {booking.booking_date.strftime("%d/%m/%Y")}</li>
-            <li>Hora: {booking.start_time.strftime("%H:%M")} - {booking.end_time.strftime("%H:%M")}</li>
-            <li>Estado: <strong>{new_status.upper()}</strong></li>
-        </ul>
-        '''
+        template='booking_status',
+        client_name=client.username,
+        pilot_name=pilot_profile.name,
+        status_title=new_status.capitalize(),
+        status_message=status_messages[new_status],
+        status_upper=new_status.upper(),
+        date=booking.booking_date.strftime("%d/%m/%Y"),
+        start_time=booking.start_time.strftime("%H:%M"),
+        end_time=booking.end_time.strftime("%H:%M")
     )
+    db.session.commit()
     
     return jsonify({"message": f"Reserva {booking.status}"})
 
+def search_cache_key(user_query):
+    # La fecha entra en la clave porque "mañana" o "el sábado" cambian cada día
+    return RecommendationCache.make_key(
+        normalize_query(user_query), get_catalog_version(), date.today().isoformat()
+    )
+
+def prepare_search(user_query):
+    """Devuelve (prompt, filtros descritos, candidatos) para una consulta"""
+    filters = parse_search_query(user_query)
+    candidates, applied = select_search_candidates(filters)
+    pilots_info = "\n".join(compact_pilot_lines(candidates)) or "No hay pilotos que encajen con la petición."
+    
+    prompt = f"""
+        Eres un asistente experto en la plataforma "DroneBook". Tu misión es ayudar a los usuarios a encontrar el piloto de dron perfecto.
+        Estos son los pilotos que mejor encajan con la petición (id, nombre, lema, ubicación, tarifa, valoración, especialidades y servicios):
+        {pilots_info}
+        ---
+        Analiza la siguiente petición de un usuario y recomiéndale el mejor piloto. Justifica brevemente por qué. Responde en español.
+        Petición del usuario: "{user_query}"
+        """
+    return prompt, describe_search_filters(filters, applied), candidates
+
+def ranked_pilots_payload(candidates):
+    """Ranking local que se devuelve cuando la IA no responde a tiempo"""
+    return [{
+        "id": profile.id,
+        "name": profile.name,
+        "tagline": profile.tagline,
+        "location": profile.location,
+        "hourly_rate": profile.hourly_rate,
+        "average_rating": profile.average_rating,
+        "total_reviews": profile.rating_count or 0,
+        "distance": round(distance, 1) if distance is not None else None
+    } for profile, distance in candidates]
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route("/api/search", methods=['POST'])
 def search_pilots():
     if not model:
@@ -1073,21 +2531,110 @@ def search_pilots():
         return jsonify({"error": "No se ha proporcionado ninguna consulta."}), 400
 
     try:
-        profiles = PilotProfile.query.all()
-        profiles_list = [p.to_dict() for p in profiles]
+        cache_key = search_cache_key(user_query)
+        cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
         
-        prompt = f"""
-        Eres un asistente experto en la plataforma "DroneBook". Tu misión es ayudar a los usuarios a encontrar el piloto de dron perfecto.
-        A continuación, te proporciono una lista de los perfiles de los pilotos disponibles en formato JSON: {profiles_list}
-        ---
-        Analiza la siguiente petición de un usuario y recomiéndale el mejor piloto. Justifica brevemente por qué. Responde en español.
-        Petición del usuario: "{user_query}"
-        """
+        prompt, filters, _ = prepare_search(user_query)
         response = model.generate_content(prompt)
-        return jsonify({"recommendation": response.text})
+        result = {
+            "recommendation": response.text,
+            "filters": filters
+        }
+        recommendation_cache.set(cache_key, result)
+        return jsonify(result)
     except Exception as e:
         return jsonify({"error": f"Ha ocurrido un error con la IA: {e}"}), 500
 
+@app.route("/api/search/stream", methods=['GET', 'POST'])
+def stream_search_pilots():
+    """Búsqueda con IA por Server-Sent Events.
+    
+    Eventos: "filters" al empezar, "chunk" por cada fragmento de la IA y "done" al
+    terminar; si la IA no está configurada, falla o supera SEARCH_STREAM_DEADLINE
+    se envía "fallback" con el ranking local de pilotos.
+    """
+    user_query = request.args.get("query") or (request.get_json(silent=True) or {}).get("query")
+    if not user_query:
+        return jsonify({"error": "No se ha proporcionado ninguna consulta."}), 400
+    
+    try:
+        cache_key = search_cache_key(user_query)
+        cached = recommendation_cache.get(cache_key)
+        if cached is None:
+            # Todo el acceso a la BD ocurre aquí, antes de empezar a emitir
+            prompt, filters, candidates = prepare_search(user_query)
+            fallback = ranked_pilots_payload(candidates)
+    except Exception as e:
+        return jsonify({"error": f"Error preparando la búsqueda: {e}"}), 500
+    
+    def cached_events():
+        yield sse_event("filters", cached.get("filters"))
+        yield sse_event("chunk", {"text": cached["recommendation"]})
+        yield sse_event("done", {"cached": True})
+    
+    def fallback_events(reason):
+        yield sse_event("fallback", {"reason": reason, "pilots": fallback})
+        yield sse_event("done", {"cached": False})
+    
+    def model_events():
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        
+        def produce():
+            try:
+                for chunk in model.generate_content(prompt, stream=True):
+                    if cancelled.is_set():
+                        return
+                    chunks.put(chunk.text)
+                chunks.put(None)
+            except Exception as e:
+                chunks.put(e)
+        
+        threading.Thread(target=produce, daemon=True).start()
+        deadline = time.monotonic() + SEARCH_STREAM_DEADLINE
+        parts = []
+        
+        try:
+            yield sse_event("filters", filters)
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise queue.Empty
+                    item = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    yield from fallback_events("timeout")
+                    return
+                
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    yield from fallback_events("error")
+                    return
+                parts.append(item)
+                yield sse_event("chunk", {"text": item})
+            
+            recommendation_cache.set(cache_key, {"recommendation": "".join(parts), "filters": filters})
+            yield sse_event("done", {"cached": False})
+        finally:
+            # También si el cliente se desconecta (el servidor cierra el generador): el productor
+            # deja de leer de la IA en el siguiente fragmento
+            cancelled.set()
+    
+    if cached is not None:
+        events = cached_events()
+    elif not model:
+        events = ([sse_event("filters", filters)] + list(fallback_events("unavailable")))
+    else:
+        events = model_events()
+    
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # --- RUTAS ADICIONALES PARA GESTIÓN PILOTO ---
 @app.route("/api/profile/services", methods=['POST'])
 def add_service():
@@ -1106,7 +2653,9 @@ def add_service():
     )
     
     db.session.add(service)
+    version_before = bump_catalog_version()
     db.session.commit()
+    sync_catalog_indexes(service.pilot_profile_id, version_before)
     
     return jsonify({"message": "Servicio añadido", "service": service.to_dict()})
 
@@ -1136,7 +2685,9 @@ def add_portfolio_item():
     )
     
     db.session.add(portfolio_item)
+    version_before = bump_catalog_version()
     db.session.commit()
+    sync_catalog_indexes(portfolio_item.pilot_profile_id, version_before)
     
     return jsonify({"message": "Imagen añadida al portfolio"})
 
@@ -1166,18 +2717,183 @@ def add_availability(pilot_id):
     )
     
     db.session.add(slot)
+    version_before = bump_catalog_version()
     db.session.commit()
+    sync_catalog_indexes(pilot_id, version_before)
     
     return jsonify({"message": "Disponibilidad añadida"})
 
+@app.route("/api/pilots/<int:pilot_id>/availability/check", methods=['POST'])
+def check_availability_slots(pilot_id):
+    """Comprueba en bloque varios huecos candidatos: {"slots": [{date, start_time, end_time}]}"""
+    if not PilotProfile.query.get(pilot_id):
+        return jsonify({"error": "Piloto no encontrado"}), 404
+    
+    slots = (request.get_json(silent=True) or {}).get('slots')
+    if not isinstance(slots, list) or not slots:
+        return jsonify({"error": "Se necesita una lista de huecos"}), 400
+    if len(slots) > SLOT_CHECK_MAX:
+        return jsonify({"error": f"Máximo {SLOT_CHECK_MAX} huecos por petición"}), 400
+    
+    parsed = []
+    try:
+        for slot in slots:
+            day = datetime.strptime(slot.get('date'), '%Y-%m-%d').date()
+            start_time = datetime.strptime(slot.get('start_time'), '%H:%M').time()
+            end_time = datetime.strptime(slot.get('end_time'), '%H:%M').time()
+            if start_time >= end_time:
+                raise ValueError
+            parsed.append((day, start_time, end_time))
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"error": "Formato de fecha/hora inválido"}), 400
+    
+    try:
+        agendas, availability = load_pilot_agendas(pilot_id, [day for day, _, _ in parsed])
+        results = []
+        for day, start_time, end_time in parsed:
+            result = check_booking_slot(agendas, availability, day, start_time, end_time)
+            result.update({
+                "date": day.isoformat(),
+                "start_time": start_time.strftime('%H:%M'),
+                "end_time": end_time.strftime('%H:%M')
+            })
+            results.append(result)
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": f"Error comprobando disponibilidad: {str(e)}"}), 500
+
+@app.route("/api/pilots/<int:pilot_id>/availability", methods=['GET'])
+def get_availability_window(pilot_id):
+    """Disponibilidad libre por día en ?from=YYYY-MM-DD&to=YYYY-MM-DD (reglas expandidas, sin reservas firmes)"""
+    if not PilotProfile.query.get(pilot_id):
+        return jsonify({"error": "Piloto no encontrado"}), 404
+    try:
+        date_from = datetime.strptime(request.args.get('from'), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.args.get('to'), '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return jsonify({"error": "Formato de fecha inválido"}), 400
+    if date_to < date_from or (date_to - date_from).days >= AVAILABILITY_WINDOW_MAX_DAYS:
+        return jsonify({"error": f"El rango debe tener entre 1 y {AVAILABILITY_WINDOW_MAX_DAYS} días"}), 400
+    
+    try:
+        days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+        agendas, availability = load_pilot_agendas(pilot_id, days)
+        window = []
+        for day in days:
+            busy = [(start, end) for start, end, (_, status) in agendas[day].items()
+                    if status in BLOCKING_BOOKING_STATUSES]
+            free = subtract_intervals(availability[day], busy)
+            if free:
+                window.append({
+                    "date": day.isoformat(),
+                    "intervals": [{"start": format_minutes(s), "end": format_minutes(e)} for s, e in free]
+                })
+        return jsonify(window)
+    except Exception as e:
+        return jsonify({"error": f"Error calculando disponibilidad: {str(e)}"}), 500
+
+@app.route("/api/pilots/<int:pilot_id>/availability/rules", methods=['POST'])
+def add_availability_rule(pilot_id):
+    """Disponibilidad semanal: {email, weekdays: [0-6, lunes=0], start_time, end_time, valid_from, valid_until?, exceptions?}"""
+    data = request.get_json()
+    user = User.query.filter_by(email=data.get('email')).first()
+    
+    if not user or user.role != 'Piloto' or not user.pilot_profile:
+        return jsonify({"error": "Usuario no es piloto"}), 403
+    
+    if user.pilot_profile.id != pilot_id:
+        return jsonify({"error": "No autorizado"}), 403
+    
+    try:
+        weekdays = 0
+        for weekday in data.get('weekdays') or []:
+            if not 0 <= int(weekday) <= 6:
+                raise ValueError
+            weekdays |= 1 << int(weekday)
+        start_time = datetime.strptime(data.get('start_time'), '%H:%M').time()
+        end_time = datetime.strptime(data.get('end_time'), '%H:%M').time()
+        valid_from = datetime.strptime(data.get('valid_from') or date.today().isoformat(), '%Y-%m-%d').date()
+        valid_until = datetime.strptime(data['valid_until'], '%Y-%m-%d').date() if data.get('valid_until') else None
+        exceptions = sorted({datetime.strptime(d, '%Y-%m-%d').date().isoformat() for d in data.get('exceptions') or []})
+    except (ValueError, TypeError):
+        return jsonify({"error": "Formato de fecha/hora inválido"}), 400
+    if not weekdays:
+        return jsonify({"error": "Indica al menos un día de la semana"}), 400
+    if start_time >= end_time or (valid_until and valid_until < valid_from):
+        return jsonify({"error": "Rango de horas o fechas inválido"}), 400
+    
+    rule = AvailabilityRule(
+        pilot_profile_id=pilot_id,
+        weekdays=weekdays,
+        start_time=start_time,
+        end_time=end_time,
+        valid_from=valid_from,
+        valid_until=valid_until,
+        exceptions=json.dumps(exceptions)
+    )
+    
+    db.session.add(rule)
+    version_before = bump_catalog_version()
+    db.session.commit()
+    sync_catalog_indexes(pilot_id, version_before)
+    
+    return jsonify({"message": "Regla de disponibilidad añadida", "rule": rule.to_dict()})
+
+@app.route("/api/availability/rules/<int:rule_id>/exceptions", methods=['POST'])
+def add_availability_exception(rule_id):
+    """Marca una fecha concreta como no disponible dentro de una regla: {email, date}"""
+    data = request.get_json()
+    rule = AvailabilityRule.query.get(rule_id)
+    if not rule:
+        return jsonify({"error": "Regla no encontrada"}), 404
+    
+    user = User.query.filter_by(email=data.get('email')).first()
+    if not user or not user.pilot_profile or user.pilot_profile.id != rule.pilot_profile_id:
+        return jsonify({"error": "No autorizado"}), 403
+    
+    try:
+        day = datetime.strptime(data.get('date'), '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return jsonify({"error": "Formato de fecha inválido"}), 400
+    
+    rule.exceptions = json.dumps(sorted(rule.exception_dates() | {day.isoformat()}))
+    version_before = bump_catalog_version()
+    db.session.commit()
+    sync_catalog_indexes(rule.pilot_profile_id, version_before)
+    
+    return jsonify({"message": "Excepción añadida", "rule": rule.to_dict()})
+
+@app.route("/api/availability/rules/<int:rule_id>", methods=['DELETE'])
+def delete_availability_rule(rule_id):
+    """Borra una regla recurrente; solo su piloto (email en la query o en el cuerpo)"""
+    rule = AvailabilityRule.query.get(rule_id)
+    if not rule:
+        return jsonify({"error": "Regla no encontrada"}), 404
+    
+    email = request.args.get('email') or (request.get_json(silent=True) or {}).get('email')
+    user = User.query.filter_by(email=email).first() if email else None
+    if not user or not user.pilot_profile or user.pilot_profile.id != rule.pilot_profile_id:
+        return jsonify({"error": "No autorizado"}), 403
+    
+    pilot_profile_id = rule.pilot_profile_id
+    db.session.delete(rule)
+    version_before = bump_catalog_version()
+    db.session.commit()
+    sync_catalog_indexes(pilot_profile_id, version_before)
+    
+    return jsonify({"message": "Regla eliminada"})
+
 @app.route("/api/availability/<int:slot_id>", methods=['DELETE'])
 def delete_availability(slot_id):
     slot = AvailabilitySlot.query.get(slot_id)
     if not slot:
         return jsonify({"error": "Horario no encontrado"}), 404
     
+    pilot_profile_id = slot.pilot_profile_id
     db.session.delete(slot)
+    version_before = bump_catalog_version()
     db.session.commit()
+    sync_catalog_indexes(pilot_profile_id, version_before)
     
     return jsonify({"message": "Horario eliminado"})
 
@@ -1194,8 +2910,11 @@ def delete_portfolio_item(item_id):
     except:
         pass
     
+    pilot_profile_id = item.pilot_profile_id
     db.session.delete(item)
+    version_before = bump_catalog_version()
     db.session.commit()
+    sync_catalog_indexes(pilot_profile_id, version_before)
     
     return jsonify({"message": "Elemento eliminado"})
 
@@ -1349,8 +3068,13 @@ def delete_user(user_id):
             return jsonify({"error": "No se puede eliminar un administrador"}), 403
         
         username = user.username
+        pilot_profile_id = user.pilot_profile.id if user.pilot_profile else None
+        if pilot_profile_id:
+            version_before = bump_catalog_version()
         db.session.delete(user)
         db.session.commit()
+        if pilot_profile_id:
+            sync_catalog_indexes(pilot_profile_id, version_before)
         
         return jsonify({"message": f"Usuario {username} eliminado correctamente"})
     except Exception as e:
@@ -1360,8 +3084,7 @@ def delete_user(user_id):
 @require_admin
 def get_all_bookings():
     try:
-        bookings = Booking.query.order_by(Booking.created_at.desc()).all()
-        return jsonify([b.to_dict() for b in bookings])
+        return bookings_page_response(booking_rows_query())
     except Exception as e:
         return jsonify({"error": f"Error obteniendo reservas: {str(e)}"}), 500
 
@@ -1383,24 +3106,54 @@ def delete_review(review_id):
         if not review:
             return jsonify({"error": "Review no encontrada"}), 404
         
+        pilot_profile = PilotProfile.query.get(review.pilot_profile_id)
+        if pilot_profile and review.rating in range(1, 6):
+            pilot_profile.apply_review_rating(review.rating, -1)
+        
+        pilot_profile_id = review.pilot_profile_id
         db.session.delete(review)
+        version_before = bump_catalog_version()
         db.session.commit()
+        sync_catalog_indexes(pilot_profile_id, version_before)
         
         return jsonify({"message": "Review eliminada correctamente"})
     except Exception as e:
         return jsonify({"error": f"Error eliminando review: {str(e)}"}), 500
 
+@app.route("/api/admin/search-cache", methods=['GET'])
+@require_admin
+def get_search_cache_stats():
+    try:
+        return jsonify(recommendation_cache.stats())
+    except Exception as e:
+        return jsonify({"error": f"Error obteniendo estadísticas de la caché: {str(e)}"}), 500
+
+@app.route("/api/admin/jobs", methods=['GET'])
+@require_admin
+def get_job_queue_stats():
+    try:
+        counts = dict(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all())
+        failed = Job.query.filter_by(status='failed').order_by(Job.id.desc()).limit(20).all()
+        return jsonify({
+            "counts": counts,
+            "recent_failures": [{
+                "id": job.id, "job_type": job.job_type, "attempts": job.attempts,
+                "last_error": job.last_error, "created_at": job.created_at.isoformat()
+            } for job in failed]
+        })
+    except Exception as e:
+        return jsonify({"error": f"Error obteniendo la cola de trabajos: {str(e)}"}), 500
+
 @app.route("/api/admin/pilots/pending", methods=['GET'])
 @require_admin
 def get_pending_pilots():
     try:
-        pilots = PilotProfile.query.filter(
+        pilots = PilotProfile.query.options(db.joinedload(PilotProfile.user)).filter(
             (PilotProfile.bio == None) | (PilotProfile.bio == '')
         ).all()
         
         pilots_list = []
-        for pilot in pilots:
-            pilot_dict = pilot.to_dict()
+        for pilot, pilot_dict in zip(pilots, pilots_to_dicts(pilots)):
             pilot_dict['user_email'] = pilot.user.email
             pilot_dict['user_created_at'] = pilot.user.created_at.isoformat()
             pilots_list.append(pilot_dict)
@@ -1456,7 +3209,9 @@ def add_certification(pilot_id):
         )
         
         db.session.add(certification)
+        version_before = bump_catalog_version()
         db.session.commit()
+        sync_catalog_indexes(pilot_id, version_before)
         
         return jsonify({
             "message": "Certificación añadida correctamente",
@@ -1482,8 +3237,11 @@ def delete_certification(cert_id):
             except:
                 pass
         
+        pilot_profile_id = certification.pilot_profile_id
         db.session.delete(certification)
+        version_before = bump_catalog_version()
         db.session.commit()
+        sync_catalog_indexes(pilot_profile_id, version_before)
         
         return jsonify({"message": "Certificación eliminada"})
     except Exception as e:
@@ -1525,14 +3283,12 @@ def verify_certification(cert_id):
         certification.verified_by = admin.id
         certification.verified_at = datetime.utcnow()
         
-        db.session.commit()
-        
-        # ✅ NOTIFICACIÓN AL PILOTO sobre verificación
+        # ✅ NOTIFICACIÓN AL PILOTO sobre verificación (en la misma transacción)
         pilot = certification.pilot_profile
         status_emoji = '✅' if status == 'verified' else '❌'
         status_text = 'verificada' if status == 'verified' else 'rechazada'
         
-        create_notification(
+        queue_notification(
             user_id=pilot.user_id,
             notification_type='certification',
             title=f'{status_emoji} Certificación {status_text}',
@@ -1541,6 +3297,10 @@ def verify_certification(cert_id):
             related_id=cert_id
         )
         
+        version_before = bump_catalog_version()
+        db.session.commit()
+        sync_catalog_indexes(certification.pilot_profile_id, version_before)
+        
         return jsonify({
             "message": f"Certificación {status}",
             "certification": certification.to_dict()
@@ -1593,7 +3353,9 @@ def add_badge(pilot_id):
         )
         
         db.session.add(badge)
+        version_before = bump_catalog_version()
         db.session.commit()
+        sync_catalog_indexes(pilot_id, version_before)
         
         return jsonify({
             "message": "Badge añadido",
@@ -1611,8 +3373,11 @@ def delete_badge(badge_id):
         if not badge:
             return jsonify({"error": "Badge no encontrado"}), 404
         
+        pilot_profile_id = badge.pilot_profile_id
         db.session.delete(badge)
+        version_before = bump_catalog_version()
         db.session.commit()
+        sync_catalog_indexes(pilot_profile_id, version_before)
         
         return jsonify({"message": "Badge eliminado"})
     except Exception as e:
@@ -1716,11 +3481,12 @@ def add_review(pilot_id):
         )
         
         db.session.add(review)
-        db.session.commit()
+        db.session.flush()
+        pilot_profile.apply_review_rating(rating, 1)
         
-        # ✅ NOTIFICACIÓN AL PILOTO sobre nueva review
+        # ✅ NOTIFICACIÓN AL PILOTO sobre nueva review (en la misma transacción)
         stars = '⭐' * rating
-        create_notification(
+        queue_notification(
             user_id=pilot_profile.user_id,
             notification_type='system',
             title=f'Nueva reseña recibida {stars}',
@@ -1729,6 +3495,10 @@ def add_review(pilot_id):
             related_id=review.id
         )
         
+        version_before = bump_catalog_version()
+        db.session.commit()
+        sync_catalog_indexes(pilot_id, version_before)
+        
         return jsonify({
             "message": "Review añadida correctamente",
             "review": review.to_dict()
@@ -1746,5 +3516,9 @@ def get_pilot_reviews(pilot_id):
     except Exception as e:
         return jsonify({"error": f"Error obteniendo reviews: {str(e)}"}), 500
 
+# Recálculo de las columnas que haya añadido migrate_schema() al arrancar (solo en el proceso que las añadió)
+with app.app_context():
+    run_schema_backfills(schema_added_columns)
+
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
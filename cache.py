@@ -0,0 +1,247 @@
+"""
+Cachés usadas por el backend: LRU en memoria y caché de recomendaciones con backends intercambiables
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Caché LRU acotada en número de entradas, segura entre hilos"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryCacheBackend:
+    """Backend LRU+TTL en memoria; cada proceso tiene su propia copia"""
+
+    def __init__(self, max_entries=1000):
+        self._lru = LRUCache(max_entries=max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._lru.get(key)
+        if entry is None or entry[1] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        self._lru.set(key, (value, time.time() + ttl))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._lru)}
+
+
+class SQLiteCacheBackend:
+    """Backend LRU+TTL en un fichero SQLite compartido por todos los workers de gunicorn.
+
+    Las lecturas no escriben: la hora del último acceso y los contadores de aciertos
+    se acumulan en memoria y se vuelcan en una sola transacción cada flush_every
+    lecturas o flush_interval segundos, y siempre en set() y stats(). Si el proceso
+    termina se pierden como mucho esas lecturas pendientes, que solo afectan al
+    orden de desalojo y a las estadísticas.
+    """
+
+    def __init__(self, path, max_entries=1000, flush_every=100, flush_interval=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending_lock = threading.Lock()
+        self._pending_access = {}  # key -> último acceso aún no escrito
+        self._pending_counts = {'hits': 0, 'misses': 0}
+        self._last_flush = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_last_access ON cache_entries (last_access)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO cache_stats (name, value) VALUES ('hits', 0), ('misses', 0)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _record(self, name, key=None, now=None):
+        """Anota un acierto/fallo; devuelve True si toca volcar lo pendiente"""
+        with self._pending_lock:
+            self._pending_counts[name] += 1
+            if key is not None:
+                self._pending_access[key] = now
+            pending = sum(self._pending_counts.values())
+            return pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval
+
+    def _take_pending(self):
+        with self._pending_lock:
+            access, self._pending_access = self._pending_access, {}
+            counts, self._pending_counts = self._pending_counts, {'hits': 0, 'misses': 0}
+            self._last_flush = time.monotonic()
+        return access, counts
+
+    def _restore_pending(self, access, counts):
+        with self._pending_lock:
+            for key, accessed_at in access.items():
+                self._pending_access[key] = max(accessed_at, self._pending_access.get(key, 0))
+            for name, value in counts.items():
+                self._pending_counts[name] += value
+
+    @staticmethod
+    def _write_pending(conn, access, counts):
+        if access:
+            conn.executemany(
+                'UPDATE cache_entries SET last_access = max(last_access, ?) WHERE key = ?',
+                [(accessed_at, key) for key, accessed_at in access.items()]
+            )
+        for name, value in counts.items():
+            if value:
+                conn.execute('UPDATE cache_stats SET value = value + ? WHERE name = ?', (value, name))
+
+    def flush(self):
+        """Escribe los accesos y contadores pendientes en una transacción"""
+        access, counts = self._take_pending()
+        if not access and not any(counts.values()):
+            return
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._write_pending(conn, access, counts)
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            self._restore_pending(access, counts)
+            raise
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?', (key, now)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        due = self._record('misses') if row is None else self._record('hits', key, now)
+        if due:
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # BD ocupada: se reintenta en el siguiente volcado
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        access, counts = self._take_pending()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Los accesos pendientes se escriben antes de desalojar para que el LRU los tenga en cuenta
+            self._write_pending(conn, access, counts)
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + ttl, now)
+            )
+            conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (now,))
+            conn.execute('''
+                DELETE FROM cache_entries WHERE key IN (
+                    SELECT key FROM cache_entries ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            self._restore_pending(access, counts)
+            raise
+        finally:
+            conn.close()
+
+    def stats(self):
+        self.flush()
+        conn = self._connect()
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM cache_stats').fetchall())
+            size = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        finally:
+            conn.close()
+        return {"hits": counters.get('hits', 0), "misses": counters.get('misses', 0), "size": size}
+
+
+class RecommendationCache:
+    """Caché de recomendaciones de la IA por consulta normalizada y versión del catálogo"""
+
+    def __init__(self, backend, ttl=6 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(normalized_query, catalog_version, day):
+        raw = f"{catalog_version}|{day}|{normalized_query}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            print(f"Error leyendo la caché de búsquedas: {e}")
+            return None
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            print(f"Error escribiendo la caché de búsquedas: {e}")
+
+    def stats(self):
+        stats = self.backend.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0
+        stats["backend"] = type(self.backend).__name__
+        stats["ttl_seconds"] = self.ttl
+        return stats
@@ -0,0 +1,130 @@
+"""
+Broker de eventos del chat para el canal de push (SSE).
+
+El canal push es opcional y está desactivado por defecto: cada conexión SSE ocupa
+una petición durante minutos, así que solo debe activarse con workers que atiendan
+varias peticiones a la vez (gunicorn -k gthread o gevent). Sin broker los clientes
+usan el sondeo.
+
+InProcessBroker (CHAT_BROKER=memory) reparte los eventos entre las conexiones del
+mismo proceso; con varios workers hace falta un broker compartido (CHAT_BROKER=redis).
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+
+class Subscription:
+    """Cola de eventos de un canal para una conexión"""
+
+    def __init__(self, broker, channel, max_pending=100):
+        self.broker = broker
+        self.channel = channel
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Cliente demasiado lento: se descarta el evento; al reconectar recupera el historial
+            pass
+
+    def get(self, timeout=None):
+        """Siguiente evento o None si pasa timeout sin eventos"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Publicación/suscripción en memoria, válida con un único proceso"""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+class RedisBroker(InProcessBroker):
+    """Reparte los eventos entre workers con Redis pub/sub.
+
+    Cada proceso mantiene un único hilo suscrito a todos los canales del chat y
+    reenvía cada mensaje a las conexiones locales mediante InProcessBroker.
+    """
+
+    RECONNECT_SECONDS = 2
+
+    def __init__(self, url, prefix='dronebook:chat:'):
+        import redis  # dependencia opcional, solo con CHAT_BROKER=redis
+
+        super().__init__()
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        threading.Thread(target=self._listen, name='chat-redis', daemon=True).start()
+
+    def _listen(self):
+        # Si Redis se cae se reintenta sin fin; los eventos de ese intervalo se pierden
+        # y los clientes los recuperan al sincronizar los mensajes
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode('utf-8')[len(self.prefix):]
+                    super().publish(channel, json.loads(message['data']))
+            except Exception as e:
+                print(f"Error en la suscripción Redis del chat, reconectando: {e}")
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(self.RECONNECT_SECONDS)
+
+    def publish(self, channel, event):
+        self._redis.publish(self.prefix + channel, json.dumps(event))
+
+
+def broker_from_env():
+    """CHAT_BROKER=none (por defecto), memory o redis (con CHAT_REDIS_URL o REDIS_URL).
+
+    Devuelve None si no hay canal push: sin CHAT_BROKER, o con memory y WEB_CONCURRENCY > 1,
+    porque un worker no vería los eventos publicados por los demás.
+    """
+    backend = os.environ.get('CHAT_BROKER', 'none')
+    if backend == 'redis':
+        url = os.environ.get('CHAT_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        return RedisBroker(url)
+    if backend != 'memory':
+        return None
+    workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    if workers > 1:
+        print(f"⚠️ Chat push desactivado: {workers} workers sin CHAT_BROKER=redis; los clientes usarán sondeo")
+        return None
+    return InProcessBroker()
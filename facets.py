@@ -0,0 +1,119 @@
+"""
+Recuentos por faceta del catálogo de pilotos usando bitsets (un int de Python por valor)
+"""
+
+import threading
+
+# (etiqueta, mínimo incluido, máximo excluido) sobre el precio "desde" del piloto
+PRICE_BUCKETS = (
+    ("0-50", 0, 50),
+    ("50-100", 50, 100),
+    ("100-200", 100, 200),
+    ("200+", 200, None),
+)
+FACETS = ("badge_type", "city", "price", "verified")
+
+
+def price_bucket(price):
+    for label, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return label
+    return PRICE_BUCKETS[0][0]
+
+
+class PilotFacetIndex:
+    """Un bitset por valor de faceta; el bit n corresponde al piloto con id n.
+
+    Los filtros de una misma faceta se combinan con OR y los de facetas
+    distintas con AND. Al contar una faceta se ignoran sus propios filtros,
+    para que la interfaz pueda mostrar cuántos pilotos añadiría cada opción.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._bitsets = {facet: {} for facet in FACETS}
+        self._values = {}  # pilot_id -> {faceta: valores}
+        self._all = 0
+
+    @staticmethod
+    def _facet_values(facts):
+        return {
+            "badge_type": set(facts["badge_types"]),
+            "city": {facts["city"]} if facts.get("city") else set(),
+            "price": {price_bucket(facts["from_price"])},
+            "verified": {"true" if facts["is_verified"] else "false"},
+        }
+
+    def _add(self, pilot_id, facts):
+        values = self._facet_values(facts)
+        bit = 1 << pilot_id
+        for facet, facet_values in values.items():
+            for value in facet_values:
+                self._bitsets[facet][value] = self._bitsets[facet].get(value, 0) | bit
+        self._values[pilot_id] = values
+        self._all |= bit
+
+    def _discard(self, pilot_id):
+        values = self._values.pop(pilot_id, None)
+        if values is None:
+            return
+        mask = ~(1 << pilot_id)
+        for facet, facet_values in values.items():
+            for value in facet_values:
+                bitset = self._bitsets[facet][value] & mask
+                if bitset:
+                    self._bitsets[facet][value] = bitset
+                else:
+                    del self._bitsets[facet][value]
+        self._all &= mask
+
+    def rebuild(self, rows, version=None):
+        """rows: iterable de (pilot_id, datos) con badge_types, city, from_price e is_verified"""
+        with self._lock:
+            self._reset()
+            for pilot_id, facts in rows:
+                self._add(pilot_id, facts)
+            self.version = version
+
+    def upsert(self, pilot_id, facts):
+        with self._lock:
+            self._discard(pilot_id)
+            self._add(pilot_id, facts)
+
+    def remove(self, pilot_id):
+        with self._lock:
+            self._discard(pilot_id)
+
+    def _facet_mask(self, facet, selected):
+        mask = 0
+        for value in selected:
+            mask |= self._bitsets[facet].get(value, 0)
+        return mask
+
+    def counts(self, filters=None):
+        """filters: {faceta: [valores]}. Devuelve (total, {faceta: {valor: nº pilotos}})"""
+        filters = {facet: values for facet, values in (filters or {}).items() if facet in FACETS and values}
+        with self._lock:
+            masks = {facet: self._facet_mask(facet, values) for facet, values in filters.items()}
+            total_mask = self._all
+            for mask in masks.values():
+                total_mask &= mask
+
+            counts = {}
+            for facet in FACETS:
+                others = self._all
+                for other, mask in masks.items():
+                    if other != facet:
+                        others &= mask
+                counts[facet] = {
+                    value: (bitset & others).bit_count()
+                    for value, bitset in self._bitsets[facet].items()
+                }
+        return total_mask.bit_count(), counts
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,167 @@
+"""
+Geocodificador offline de municipios españoles a partir de data/municipios_es.csv
+
+Las primeras filas son municipios principales con sus nombres alternativos; el resto
+procede de GeoNames (cities1000, https://www.geonames.org, CC BY 4.0): unas 6.800
+poblaciones de más de 1.000 habitantes, con la provincia en castellano.
+"""
+
+import bisect
+import csv
+import os
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+from text_index import STOPWORDS
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'municipios_es.csv')
+
+# Palabras que no aportan nada a la localización ("Madrid, España") o que, solas, son
+# palabras corrientes de una búsqueda aunque exista una población con ese nombre
+IGNORED_TOKENS = STOPWORDS | {
+    'espana', 'spain', 'provincia', 'centro',
+    'buena', 'campo', 'campos', 'tejado',
+}
+MAX_NGRAM = 6
+# Un texto incompleto solo se acepta como prefijo si tiene al menos estos caracteres
+# y corresponde a una única población
+PREFIX_MIN_CHARS = 4
+
+
+def normalize_place(text):
+    """Minúsculas, sin tildes y sin signos de puntuación"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[^a-z0-9,]+", ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class Gazetteer:
+    """Índice de municipios con búsqueda exacta, por n-gramas y por prefijo.
+
+    Un mismo nombre puede corresponder a varias poblaciones (Mieres, Asturias y
+    Mieres, Girona); se guardan todas y la provincia escrita en el texto decide.
+    """
+
+    def __init__(self, rows):
+        self._places = {}  # nombre normalizado -> [poblaciones], la primera es la preferida
+        for row in rows:
+            key = normalize_place(row['nombre'])
+            if not key:
+                continue
+            place = {
+                "name": row['nombre'],
+                "province": row['provincia'],
+                "lat": float(row['lat']),
+                "lng": float(row['lng']),
+            }
+            homonyms = self._places.setdefault(key, [])
+            if all(normalize_place(p['province']) != normalize_place(place['province']) for p in homonyms):
+                homonyms.append(place)
+        self._keys = sorted(self._places)
+
+    @classmethod
+    def from_csv(cls, path=GAZETTEER_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(csv.DictReader(f))
+
+    def __len__(self):
+        return len(self._places)
+
+    def exact(self, key, hints=()):
+        """Población con ese nombre normalizado; hints (textos normalizados) elige la provincia"""
+        homonyms = self._places.get(key)
+        if not homonyms:
+            return None
+        for place in homonyms:
+            if normalize_place(place['province']) in hints:
+                return place
+        return homonyms[0]
+
+    def prefix(self, prefix, limit=10):
+        """Municipios cuyo nombre normalizado empieza por prefix, los más cortos primero"""
+        start = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[start:]:
+            if not key.startswith(prefix):
+                break
+            matches.extend(self._places[key])
+        matches.sort(key=lambda place: len(place['name']))
+        return matches[:limit]
+
+    def find_in_text(self, text, hints=(), single_words=None):
+        """Primer municipio nombrado dentro de un texto normalizado (el n-grama más largo gana).
+
+        single_words: posiciones de token que pueden ser un municipio de una sola palabra
+        (None = cualquiera); los nombres de varias palabras se aceptan en cualquier posición.
+        """
+        tokens = text.replace(',', ' ').split()
+        for size in range(min(MAX_NGRAM, len(tokens)), 0, -1):
+            for i in range(len(tokens) - size + 1):
+                ngram = tokens[i:i + size]
+                if size == 1 and (ngram[0] in IGNORED_TOKENS
+                                  or (single_words is not None and i not in single_words)):
+                    continue
+                place = self.exact(' '.join(ngram), hints)
+                if place:
+                    return place
+        return None
+
+    def geocode(self, location):
+        """Devuelve {name, province, lat, lng} o None"""
+        normalized = normalize_place(location)
+        if not normalized:
+            return None
+
+        parts = [p.strip() for p in normalized.split(',') if p.strip()]
+        hints = set(parts)
+        for candidate in [normalized.replace(',', ' ').strip()] + parts:
+            candidate = re.sub(r'\s+', ' ', candidate)
+            place = self.exact(candidate, hints)
+            if place:
+                return place
+
+        # N-gramas más largos primero: "centro de sevilla" -> "sevilla"
+        for part in parts:
+            place = self.find_in_text(part, hints)
+            if place:
+                return place
+
+        # Texto incompleto ("alcobend") -> solo si el prefijo identifica una única población
+        first = parts[0] if parts else normalized
+        if len(first) >= PREFIX_MIN_CHARS:
+            matches = self.prefix(first, limit=2)
+            if len(matches) == 1:
+                return matches[0]
+        return None
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer.from_csv()
+    return _gazetteer
+
+
+@lru_cache(maxsize=4096)
+def _geocode_normalized(normalized):
+    return get_gazetteer().geocode(normalized)
+
+
+def geocode(location):
+    """Geocodifica una localización libre ("Alcalá de Henares, Madrid"); None si no se reconoce"""
+    place = _geocode_normalized(normalize_place(location))
+    return dict(place) if place else None
+
+
+def geocode_many(locations):
+    """Geocodifica en bloque; devuelve {localización: resultado o None} sin repetir búsquedas"""
+    return {location: geocode(location) for location in set(locations) if location}
@@ -0,0 +1,155 @@
+"""
+Utilidades geográficas: distancias, cajas de búsqueda e índice de vecinos más cercanos
+"""
+
+import heapq
+import threading
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+
+
+def bounding_box(lat, lng, radius_km):
+    """Caja (min_lat, max_lat, min_lng, max_lng) que contiene el círculo de radio radius_km"""
+    delta_lat = radius_km / KM_PER_DEGREE_LAT
+    min_lat = max(lat - delta_lat, -90.0)
+    max_lat = min(lat + delta_lat, 90.0)
+
+    # Cerca de los polos la caja cubre todas las longitudes
+    cos_lat = cos(radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat < 1e-6:
+        return min_lat, max_lat, -180.0, 180.0
+
+    delta_lng = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    if delta_lng >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lng - delta_lng, lng + delta_lng
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Distancia en km desde (lat, lng) a cada punto de los arrays lats/lngs"""
+    lat1 = np.radians(lat)
+    lng1 = np.radians(lng)
+    lats2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs2 = np.radians(np.asarray(lngs, dtype=np.float64))
+
+    a = (np.sin((lats2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lats2) * np.sin((lngs2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def to_unit_vector(lat, lng):
+    """Coordenadas (x, y, z) sobre la esfera unidad"""
+    lat_r, lng_r = radians(lat), radians(lng)
+    return (cos(lat_r) * cos(lng_r), cos(lat_r) * sin(lng_r), sin(lat_r))
+
+
+def chord_to_km(chord):
+    """Convierte la distancia euclídea entre vectores unitarios a distancia sobre la superficie"""
+    return 2 * EARTH_RADIUS_KM * asin(min(chord / 2, 1.0))
+
+
+class PilotSpatialIndex:
+    """KD-tree de pilotos sobre la esfera unidad con actualizaciones incrementales.
+
+    Las altas y cambios de coordenadas van a un buffer que se recorre de forma
+    lineal; las posiciones antiguas quedan marcadas como borradas en el árbol.
+    Cuando el buffer crece demasiado el árbol se reconstruye.
+    """
+
+    def __init__(self, rebuild_ratio=0.1, min_rebuild=64):
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self.version = None
+        self._lock = threading.Lock()
+        self._reset({})
+
+    def _reset(self, points):
+        self._points = dict(points)
+        self._ids = list(self._points.keys())
+        self._coords = [self._points[pid] for pid in self._ids]
+        self._root = self._build(list(range(len(self._ids))), 0)
+        self._pending = {}
+        self._deleted = set()
+
+    def _build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % 3
+        indices.sort(key=lambda i: self._coords[i][axis])
+        mid = len(indices) // 2
+        return (indices[mid], axis,
+                self._build(indices[:mid], depth + 1),
+                self._build(indices[mid + 1:], depth + 1))
+
+    def rebuild(self, rows, version=None):
+        """rows: iterable de (pilot_id, latitude, longitude)"""
+        points = {pid: to_unit_vector(lat, lng) for pid, lat, lng in rows
+                  if lat is not None and lng is not None}
+        with self._lock:
+            self._reset(points)
+            self.version = version
+
+    def upsert(self, pilot_id, lat, lng):
+        if lat is None or lng is None:
+            self.remove(pilot_id)
+            return
+        with self._lock:
+            if pilot_id in self._points:
+                self._deleted.add(pilot_id)
+            self._pending[pilot_id] = to_unit_vector(lat, lng)
+            self._maybe_compact()
+
+    def remove(self, pilot_id):
+        with self._lock:
+            self._pending.pop(pilot_id, None)
+            if pilot_id in self._points:
+                self._deleted.add(pilot_id)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dirty = len(self._pending) + len(self._deleted)
+        if dirty > max(self.min_rebuild, self.rebuild_ratio * len(self._ids)):
+            points = {pid: vec for pid, vec in self._points.items() if pid not in self._deleted}
+            points.update(self._pending)
+            self._reset(points)
+
+    def nearest(self, lat, lng, k=10):
+        """Devuelve [(pilot_id, distancia_km)] de los k pilotos más cercanos"""
+        target = to_unit_vector(lat, lng)
+        with self._lock:
+            heap = []  # max-heap por distancia al cuadrado: (-d2, pilot_id)
+
+            def consider(pid, vec):
+                d2 = (vec[0] - target[0]) ** 2 + (vec[1] - target[1]) ** 2 + (vec[2] - target[2]) ** 2
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d2, pid))
+                elif d2 < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d2, pid))
+
+            def search(node):
+                if node is None:
+                    return
+                index, axis, left, right = node
+                pid = self._ids[index]
+                if pid not in self._deleted:
+                    consider(pid, self._coords[index])
+                diff = target[axis] - self._coords[index][axis]
+                near, far = (left, right) if diff < 0 else (right, left)
+                search(near)
+                if len(heap) < k or diff * diff < -heap[0][0]:
+                    search(far)
+
+            if k > 0:
+                search(self._root)
+                for pid, vec in self._pending.items():
+                    consider(pid, vec)
+
+            results = sorted((-neg_d2, pid) for neg_d2, pid in heap)
+        return [(pid, chord_to_km(sqrt(d2))) for d2, pid in results]
+
+    def __len__(self):
+        return len(self._points) - len(self._deleted) + len(self._pending)
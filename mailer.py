@@ -0,0 +1,226 @@
+"""
+Envío de emails: plantillas compiladas una vez, conexiones SMTP reutilizadas y envío
+en lote agrupando los mensajes de un mismo destinatario en un único email.
+
+Sin SMTP_HOST los emails se imprimen por consola. Para probar el envío real en local:
+    python -m smtpd -n -c DebuggingServer localhost:1025   (Python 3.11)
+    python -m aiosmtpd -n -l localhost:1025                (con aiosmtpd instalado)
+y arrancar el worker con SMTP_HOST=localhost SMTP_PORT=1025.
+"""
+
+import os
+import smtplib
+import threading
+from email.message import EmailMessage
+from functools import lru_cache
+from html import escape
+from string import Template
+
+MAIL_FROM = os.environ.get('MAIL_FROM', 'DroneBook <no-reply@dronebook.app>')
+
+# nombre -> (asunto, html); los valores del contexto se escapan al renderizar
+EMAIL_TEMPLATES = {
+    "booking_request": (
+        "Nueva Reserva en DroneBook",
+        """
+        <h2>Nueva Solicitud de Reserva</h2>
+        <p>Hola $pilot_name,</p>
+        <p><strong>$client_name</strong> ha solicitado una reserva:</p>
+        <ul>
+            <li>Fecha: $date</li>
+            <li>Hora: $start_time - $end_time</li>
+            <li>Descripción: $description</li>
+            <li>Precio: €$price</li>
+        </ul>
+        <p>Accede a DroneBook para aceptar o rechazar la reserva.</p>
+        """,
+    ),
+    "booking_status": (
+        "Reserva $status_title - DroneBook",
+        """
+        <h2>Estado de Reserva Actualizado</h2>
+        <p>Hola $client_name,</p>
+        <p><strong>$pilot_name</strong> $status_message tu reserva:</p>
+        <ul>
+            <li>Fecha: $date</li>
+            <li>Hora: $start_time - $end_time</li>
+            <li>Estado: <strong>$status_upper</strong></li>
+        </ul>
+        """,
+    ),
+    "payment_received": (
+        "Pago Recibido - DroneBook",
+        """
+        <h2>¡Has recibido un pago!</h2>
+        <p>Hola $pilot_name,</p>
+        <p>El cliente <strong>$client_name</strong> ha completado el pago de:</p>
+        <ul>
+            <li>Monto: <strong>€$amount</strong></li>
+            <li>Reserva: $date</li>
+            <li>Servicio: $description</li>
+        </ul>
+        <p>El pago se procesará según los términos acordados.</p>
+        """,
+    ),
+}
+DIGEST_SUBJECT = "Tienes $count novedades en DroneBook"
+
+
+@lru_cache(maxsize=None)
+def _compiled(name):
+    subject, html = EMAIL_TEMPLATES[name]
+    return Template(subject), Template(html)
+
+
+def render_email(name, context):
+    """Devuelve (asunto, html) de una plantilla; KeyError si falta la plantilla o un valor"""
+    subject, html = _compiled(name)
+    safe = {key: escape(str(value)) for key, value in context.items()}
+    return subject.substitute(safe), html.substitute(safe)
+
+
+class SMTPConnectionPool:
+    """Conexiones SMTP abiertas que se reutilizan entre envíos (comprobadas con NOOP)"""
+
+    def __init__(self, host, port=587, username=None, password=None, use_tls=True, size=2, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._quit(conn)
+
+    def release(self, conn, broken=False):
+        with self._lock:
+            if not broken and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        self._quit(conn)
+
+    @staticmethod
+    def _quit(conn):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn)
+
+
+class Mailer:
+    """Envía lotes de emails; con pool=None los imprime por consola"""
+
+    def __init__(self, pool=None, sender=MAIL_FROM):
+        self.pool = pool
+        self.sender = sender
+
+    @staticmethod
+    def coalesce(messages):
+        """Agrupa [(destinatario, asunto, html)] en un email por destinatario (resumen si hay varios)"""
+        grouped = {}
+        for to_email, subject, html in messages:
+            grouped.setdefault(to_email, []).append((subject, html))
+
+        coalesced = []
+        for to_email, items in grouped.items():
+            if len(items) == 1:
+                subject, html = items[0]
+            else:
+                subject = Template(DIGEST_SUBJECT).substitute(count=len(items))
+                html = "<hr>".join(f"<h3>{escape(s)}</h3>{h}" for s, h in items)
+            coalesced.append((to_email, subject, html))
+        return coalesced
+
+    def _build(self, to_email, subject, html):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to_email
+        message['Subject'] = subject
+        message.set_content("Este mensaje necesita un cliente de correo compatible con HTML.")
+        message.add_alternative(html, subtype='html')
+        return message
+
+    def send_batch(self, messages):
+        """Envía [(destinatario, asunto, html)] con una sola conexión.
+
+        Devuelve {destinatario: None si se envió o el texto del error}.
+        """
+        results = {}
+        coalesced = self.coalesce(messages)
+        if self.pool is None:
+            for to_email, subject, html in coalesced:
+                print(f"""
+        ==================== EMAIL ====================
+        Para: {to_email}
+        Asunto: {subject}
+        Contenido:
+        {html}
+        ===============================================
+        """)
+                results[to_email] = None
+            return results
+
+        try:
+            conn = self.pool.acquire()
+        except (smtplib.SMTPException, OSError) as e:
+            return {to_email: f"Error conectando con SMTP: {e}" for to_email, _, _ in coalesced}
+
+        broken = False
+        for to_email, subject, html in coalesced:
+            if broken:
+                results[to_email] = "Conexión SMTP perdida"
+                continue
+            try:
+                conn.send_message(self._build(to_email, subject, html))
+                results[to_email] = None
+            except smtplib.SMTPRecipientsRefused as e:
+                results[to_email] = f"Destinatario rechazado: {e}"
+            except (smtplib.SMTPException, OSError) as e:
+                results[to_email] = f"Error enviando email: {e}"
+                broken = isinstance(e, (smtplib.SMTPServerDisconnected, OSError))
+        self.pool.release(conn, broken=broken)
+        return results
+
+
+def mailer_from_env():
+    """Mailer configurado con SMTP_HOST/SMTP_PORT/SMTP_USER/SMTP_PASSWORD/SMTP_USE_TLS"""
+    host = os.environ.get('SMTP_HOST')
+    if not host:
+        return Mailer()
+    pool = SMTPConnectionPool(
+        host,
+        port=int(os.environ.get('SMTP_PORT', 587)),
+        username=os.environ.get('SMTP_USER'),
+        password=os.environ.get('SMTP_PASSWORD'),
+        use_tls=os.environ.get('SMTP_USE_TLS', 'true').lower() == 'true',
+        size=int(os.environ.get('SMTP_POOL_SIZE', 2)),
+    )
+    return Mailer(pool)
@@ -0,0 +1,139 @@
+"""
+Análisis de consultas en lenguaje natural para la búsqueda de pilotos:
+extrae ciudad, presupuesto, fecha y especialidades (tipos de badge)
+"""
+
+import re
+import unicodedata
+from datetime import date, timedelta
+
+from gazetteer import get_gazetteer, normalize_place
+
+SPECIALTY_KEYWORDS = {
+    "wedding": ["boda", "bodas", "novios", "nupcial", "matrimonio", "comunion", "bautizo"],
+    "real_estate": ["inmobiliaria", "inmobiliario", "inmobiliarias", "piso", "pisos", "casa", "casas",
+                    "vivienda", "viviendas", "chalet", "propiedad", "propiedades", "hotel"],
+    "inspection": ["inspeccion", "inspecciones", "tejado", "tejados", "fachada", "fachadas",
+                   "termografia", "termografica", "torre", "industrial", "placas solares", "aerogenerador"],
+    "agriculture": ["agricultura", "agricola", "cultivo", "cultivos", "finca", "vinedo", "olivar", "cosecha"],
+    "film": ["cine", "pelicula", "spot", "publicidad", "publicitario", "anuncio", "videoclip",
+             "rodaje", "audiovisual", "documental"],
+    "sports": ["deporte", "deportes", "deportivo", "partido", "carrera", "maraton", "futbol",
+               "torneo", "regata", "ciclismo"],
+}
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+WEEKDAYS = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+
+BUDGET_PATTERNS = [
+    r"(?:menos de|hasta|maximo|max|presupuesto(?: de)?|por debajo de|no mas de)\s*(\d{2,5})",
+    r"(\d{2,5})\s*(?:€|euros?|eur\b)",
+]
+
+
+def _fold(text):
+    """Minúsculas y sin tildes, conservando dígitos y signos (fechas, €)"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def normalize_query(query):
+    """Forma canónica de una consulta para usarla como clave de caché"""
+    return " ".join(re.findall(r"[\w€]+", _fold(query)))
+
+
+def _parse_budget(text):
+    for pattern in BUDGET_PATTERNS:
+        match = re.search(pattern, text)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _parse_date(text, today):
+    match = re.search(r"\b(\d{4})-(\d{2})-(\d{2})\b", text)
+    if match:
+        year, month, day = map(int, match.groups())
+        return _safe_date(year, month, day)
+
+    match = re.search(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b", text)
+    if match:
+        day, month = int(match.group(1)), int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else None
+        if year is not None and year < 100:
+            year += 2000
+        return _upcoming(today, month, day, year)
+
+    match = re.search(r"\b(\d{1,2}) de (" + "|".join(MONTHS) + r")\b", text)
+    if match:
+        return _upcoming(today, MONTHS[match.group(2)], int(match.group(1)))
+
+    if re.search(r"\bpasado manana\b", text):
+        return today + timedelta(days=2)
+    if re.search(r"\bmanana\b", text):
+        return today + timedelta(days=1)
+    if re.search(r"\bhoy\b", text):
+        return today
+
+    match = re.search(r"\b(" + "|".join(WEEKDAYS) + r")\b", text)
+    if match:
+        days_ahead = (WEEKDAYS[match.group(1)] - today.weekday()) % 7
+        return today + timedelta(days=days_ahead or 7)
+    return None
+
+
+def _safe_date(year, month, day):
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _upcoming(today, month, day, year=None):
+    """Fecha con año explícito o, si no lo hay, la próxima vez que ocurra"""
+    if year is not None:
+        return _safe_date(year, month, day)
+    candidate = _safe_date(today.year, month, day)
+    if candidate and candidate < today:
+        candidate = _safe_date(today.year + 1, month, day)
+    return candidate
+
+
+def _parse_specialties(text):
+    found = []
+    for badge_type, keywords in SPECIALTY_KEYWORDS.items():
+        if any(re.search(r"\b" + re.escape(k) + r"\b", text) for k in keywords):
+            found.append(badge_type)
+    return found
+
+
+# Una población de una sola palabra solo cuenta tras una de estas preposiciones o escrita
+# con mayúscula en mitad de la consulta: "boda en Nava" sí, "para una boda" o "la feria" no
+CITY_MARKERS = {"en", "de"}
+
+
+def _parse_city(query):
+    words = re.findall(r"\w+", query or '')
+    tokens = [normalize_place(w) for w in words]
+    shouting = (query or '').isupper()
+    single_words = {
+        i for i, word in enumerate(words)
+        if (i > 0 and tokens[i - 1] in CITY_MARKERS) or (i > 0 and word[0].isupper() and not shouting)
+    }
+    place = get_gazetteer().find_in_text(" ".join(tokens), single_words=single_words)
+    return dict(place) if place else None
+
+
+def parse_search_query(query, today=None):
+    """Devuelve {"city", "budget", "date", "badge_types"} extraídos de la consulta"""
+    today = today or date.today()
+    text = _fold(query)
+    return {
+        "city": _parse_city(query),
+        "budget": _parse_budget(text),
+        "date": _parse_date(text, today),
+        "badge_types": _parse_specialties(text),
+    }
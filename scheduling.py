@@ -0,0 +1,98 @@
+"""
+Utilidades de agenda: intervalos del día en minutos desde medianoche
+"""
+
+import bisect
+
+
+def to_minutes(value):
+    """datetime.time -> minutos desde las 00:00"""
+    return value.hour * 60 + value.minute
+
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def merge_intervals(intervals):
+    """Une intervalos [inicio, fin) que se solapan o se tocan; devuelve la lista ordenada"""
+    merged = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def subtract_intervals(free, busy):
+    """Quita de los intervalos libres los ocupados; ambos se normalizan antes"""
+    busy = merge_intervals(busy)
+    result = []
+    for start, end in merge_intervals(free):
+        cursor = start
+        for busy_start, busy_end in busy:
+            if busy_end <= cursor:
+                continue
+            if busy_start >= end:
+                break
+            if busy_start > cursor:
+                result.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def covers(intervals, start, end):
+    """True si algún intervalo (ya unido) contiene por completo [start, end)"""
+    return any(s <= start and end <= e for s, e in intervals)
+
+
+class DayAgenda:
+    """Intervalos de un piloto en un día, ordenados por inicio, para buscar solapes.
+
+    Junto a la lista se guarda el máximo fin acumulado, de modo que la búsqueda
+    recorre hacia atrás desde el primer inicio >= fin y se detiene en cuanto
+    ningún intervalo anterior puede llegar a solapar.
+    """
+
+    def __init__(self, intervals=()):
+        self._items = []  # (inicio, fin, dato)
+        self._starts = []
+        self._max_ends = []
+        for start, end, payload in intervals:
+            self.add(start, end, payload)
+
+    def add(self, start, end, payload=None):
+        i = bisect.bisect_right(self._starts, start)
+        self._items.insert(i, (start, end, payload))
+        self._starts.insert(i, start)
+        self._max_ends.insert(i, 0)
+        for j in range(i, len(self._items)):
+            previous = self._max_ends[j - 1] if j else 0
+            self._max_ends[j] = max(previous, self._items[j][1])
+
+    def overlapping(self, start, end):
+        """Datos de los intervalos que se solapan con [start, end), por orden de inicio"""
+        found = []
+        j = bisect.bisect_left(self._starts, end) - 1
+        while j >= 0 and self._max_ends[j] > start:
+            item_start, item_end, payload = self._items[j]
+            if item_end > start:
+                found.append(payload)
+            j -= 1
+        found.reverse()
+        return found
+
+    def items(self):
+        """Lista de (inicio, fin, dato) ordenada por inicio"""
+        return list(self._items)
+
+    def __len__(self):
+        return len(self._items)
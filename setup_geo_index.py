@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Crea las extensiones e índices geográficos de PostgreSQL usados por /api/pilots/nearby
+Uso:
+    python3 setup_geo_index.py            # crea extensiones e índices
+    python3 setup_geo_index.py --explain  # muestra el plan de la consulta con la BD actual
+
+Con pocas filas el planificador elige con razón un seq scan; tests/test_geo_index.py
+comprueba con datos suficientes que el índice se usa sin forzar el planificador.
+"""
+
+import sys
+
+from backend import get_db_connection, NEARBY_PILOTS_SQL
+
+GEO_INDEX_NAME = 'idx_pilot_profiles_earth'
+
+GEO_EXTENSIONS_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS cube',
+    'CREATE EXTENSION IF NOT EXISTS earthdistance',
+]
+GEO_INDEX_SQL = f'''CREATE INDEX IF NOT EXISTS {GEO_INDEX_NAME}
+    ON pilot_profiles USING gist (ll_to_earth(latitude, longitude))
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL'''
+
+GEO_SETUP_SQL = GEO_EXTENSIONS_SQL + [GEO_INDEX_SQL, 'ANALYZE pilot_profiles']
+
+
+def create_geo_index():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        for statement in GEO_SETUP_SQL:
+            cur.execute(statement)
+        conn.commit()
+        print(f"✅ Índice geográfico {GEO_INDEX_NAME} listo")
+    finally:
+        cur.close()
+        conn.close()
+
+
+def nearby_plan(cur, lat=40.4168, lng=-3.7038, radius_km=25, limit=100):
+    """Plan de EXPLAIN de la consulta de cercanía, con la configuración normal del planificador"""
+    cur.execute('EXPLAIN ' + NEARBY_PILOTS_SQL, {
+        'lat': lat, 'lng': lng, 'radius_m': radius_km * 1000, 'limit': limit
+    })
+    return "\n".join(row['QUERY PLAN'] for row in cur.fetchall())
+
+
+def explain_nearby():
+    """Muestra el plan de la consulta de cercanía e indica si usa el índice GiST"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        plan = nearby_plan(cur)
+    finally:
+        cur.close()
+        conn.close()
+
+    print(plan)
+    if GEO_INDEX_NAME not in plan:
+        print(f"❌ La consulta no usa {GEO_INDEX_NAME} (normal si la tabla tiene pocas filas)")
+        return False
+    print(f"✅ La consulta usa {GEO_INDEX_NAME}")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--explain":
+        sys.exit(0 if explain_nearby() else 1)
+    else:
+        create_geo_index()
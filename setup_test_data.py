@@ -11,6 +11,7 @@ from datetime import datetime, date, time, timedelta
 
 # Importar los modelos del backend
 from backend import app, db, User, PilotProfile, ServicePackage, AvailabilitySlot, PortfolioItem
+from gazetteer import geocode_many
 
 def create_test_data():
     with app.app_context():
@@ -107,6 +108,8 @@ def create_test_data():
             }
         ]
         
+        places = geocode_many(p['location'] for p in pilots_data)
+        
         created_pilots = {}
         for pilot_data in pilots_data:
             user = created_users[pilot_data['user']]
@@ -118,10 +121,13 @@ def create_test_data():
                 created_pilots[pilot_data['user']] = existing_profile
                 continue
                 
+            place = places.get(pilot_data['location']) or {}
             profile = PilotProfile(
                 name=pilot_data['name'],
                 tagline=pilot_data['tagline'], 
                 location=pilot_data['location'],
+                latitude=place.get('lat'),
+                longitude=place.get('lng'),
                 bio=pilot_data['bio'],
                 hourly_rate=pilot_data['hourly_rate'],
                 phone=pilot_data['phone'],
@@ -1,4 +1,5 @@
 #!/bin/bash
 pip install -r requirements.txt
 python3 setup_db.py
+python3 setup_geo_index.py
 gunicorn backend:app
\ No newline at end of file
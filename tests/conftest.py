@@ -0,0 +1,120 @@
+"""
+Configuración común de los tests: BD SQLite temporal, contador de consultas SQL
+y servidor SMTP local de depuración
+"""
+
+import email
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['JOB_WORKER'] = 'external'  # los tests procesan la cola explícitamente
+os.environ['SEARCH_CACHE_BACKEND'] = 'memory'  # sin ficheros de caché dentro del repo
+
+import backend_sqlite  # noqa: E402
+from backend_sqlite import db, CatalogState  # noqa: E402
+
+
+class QueryCounter:
+    """Cuenta las sentencias que llegan al cursor mientras está activo"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    """Servidor SMTP local que guarda los mensajes en vez de entregarlos (como smtpd.DebuggingServer)"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSessionHandler)
+        self.connections = 0
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPSessionHandler(socketserver.StreamRequestHandler):
+    """Lo justo del protocolo SMTP para smtplib: EHLO, MAIL, RCPT, DATA, NOOP y QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost ESMTP debug")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.strip().split(b" ", 1)[0].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 localhost")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b".\r\n", b""):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                self.server.messages.append(email.message_from_bytes(b"".join(lines)))
+                self.reply("250 OK")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@pytest.fixture
+def smtp_server():
+    server = DebuggingSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app():
+    app = backend_sqlite.app
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(CatalogState(id=1, version=1))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def count_queries(app):
+    return lambda: QueryCounter(db.engine)
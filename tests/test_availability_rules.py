@@ -0,0 +1,34 @@
+from datetime import date, time
+
+from backend_sqlite import db, User, PilotProfile, AvailabilityRule
+
+
+def add_pilot(n):
+    user = User(username=f"piloto{n}", email=f"piloto{n}@example.com", password="x", role="Piloto")
+    db.session.add(user)
+    db.session.flush()
+    profile = PilotProfile(name=f"Piloto {n}", user_id=user.id)
+    db.session.add(profile)
+    db.session.flush()
+    return profile
+
+
+def test_only_the_owner_can_delete_a_rule(app):
+    owner = add_pilot(1)
+    add_pilot(2)
+    rule = AvailabilityRule(pilot_profile_id=owner.id, weekdays=0b11111, start_time=time(9),
+                            end_time=time(18), valid_from=date(2030, 1, 1))
+    db.session.add(rule)
+    db.session.commit()
+    rule_id = rule.id
+    http = app.test_client()
+
+    assert http.delete(f"/api/availability/rules/{rule_id}").status_code == 403
+    assert http.delete(f"/api/availability/rules/{rule_id}",
+                       query_string={"email": "piloto2@example.com"}).status_code == 403
+    assert db.session.get(AvailabilityRule, rule_id) is not None
+
+    response = http.delete(f"/api/availability/rules/{rule_id}", query_string={"email": "piloto1@example.com"})
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert db.session.get(AvailabilityRule, rule_id) is None
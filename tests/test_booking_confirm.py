@@ -0,0 +1,95 @@
+import threading
+from datetime import date, time
+
+import pytest
+
+from backend_sqlite import db, User, PilotProfile, Booking
+
+
+@pytest.fixture
+def overlapping_bookings(app):
+    pilot_user = User(username="piloto", email="piloto@example.com", password="x", role="Piloto")
+    client = User(username="cliente", email="cliente@example.com", password="x", role="Cliente")
+    db.session.add_all([pilot_user, client])
+    db.session.flush()
+    profile = PilotProfile(name="Piloto", user_id=pilot_user.id)
+    db.session.add(profile)
+    db.session.flush()
+    bookings = [
+        Booking(job_description="Boda", booking_date=date(2030, 6, 1), start_time=time(10), end_time=time(12),
+                client_id=client.id, pilot_profile_id=profile.id, total_price=100),
+        Booking(job_description="Finca", booking_date=date(2030, 6, 1), start_time=time(11), end_time=time(13),
+                client_id=client.id, pilot_profile_id=profile.id, total_price=100),
+    ]
+    db.session.add_all(bookings)
+    db.session.commit()
+    ids = [b.id for b in bookings]
+    db.session.remove()
+    return ids
+
+
+def confirm(app, booking_id):
+    return app.test_client().post(f"/api/bookings/{booking_id}/respond", json={"status": "confirmed"})
+
+
+def test_second_overlapping_confirmation_is_rejected(app, overlapping_bookings):
+    first, second = overlapping_bookings
+
+    response = confirm(app, first)
+    assert response.status_code == 200
+
+    response = confirm(app, second)
+    assert response.status_code == 409
+    check = response.get_json()["schedule_check"]
+    assert check["conflicting_booking_ids"] == [first]
+    assert second not in check["pending_booking_ids"]
+
+
+def test_concurrent_overlapping_confirmations(app, overlapping_bookings):
+    barrier = threading.Barrier(len(overlapping_bookings))
+    statuses = []
+
+    def worker(booking_id):
+        barrier.wait()
+        statuses.append(confirm(app, booking_id).status_code)
+
+    threads = [threading.Thread(target=worker, args=(bid,)) for bid in overlapping_bookings]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [200, 409]
+    confirmed = Booking.query.filter_by(status="confirmed").count()
+    assert confirmed == 1
+
+
+def respond(app, booking_id, status):
+    return app.test_client().post(f"/api/bookings/{booking_id}/respond", json={"status": status})
+
+
+def test_booking_already_answered_returns_conflict(app, overlapping_bookings):
+    first, _ = overlapping_bookings
+
+    assert respond(app, first, "rejected").status_code == 200
+    response = respond(app, first, "confirmed")
+    assert response.status_code == 409
+    assert response.get_json()["status"] == "rejected"
+
+
+def test_concurrent_answers_to_the_same_booking(app, overlapping_bookings):
+    first, _ = overlapping_bookings
+    barrier = threading.Barrier(3)
+    statuses = []
+
+    def worker(status):
+        barrier.wait()
+        statuses.append(respond(app, first, status).status_code)
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in ("confirmed", "confirmed", "rejected")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [200, 409, 409]
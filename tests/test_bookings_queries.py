@@ -0,0 +1,57 @@
+from datetime import date, time
+
+from backend_sqlite import db, User, PilotProfile, ServicePackage, Booking, Payment
+
+
+def add_bookings(client_id, n):
+    start = Booking.query.count()
+    for i in range(start, start + n):
+        pilot_user = User(username=f"piloto{i}", email=f"piloto{i}@example.com", password="x", role="Piloto")
+        db.session.add(pilot_user)
+        db.session.flush()
+        profile = PilotProfile(name=f"Piloto {i}", user_id=pilot_user.id)
+        db.session.add(profile)
+        db.session.flush()
+        service = ServicePackage(name="Boda", description="Vídeo", price=100, pilot_profile_id=profile.id)
+        db.session.add(service)
+        db.session.flush()
+        booking = Booking(job_description="Boda", booking_date=date(2030, 1, 1 + i % 28),
+                          start_time=time(10), end_time=time(12), total_price=100,
+                          client_id=client_id, pilot_profile_id=profile.id, service_package_id=service.id)
+        db.session.add(booking)
+        db.session.flush()
+        db.session.add_all([
+            Payment(booking_id=booking.id, stripe_payment_intent_id=f"pi_{i}_a", amount=100, status="failed"),
+            Payment(booking_id=booking.id, stripe_payment_intent_id=f"pi_{i}_b", amount=100, status="succeeded"),
+        ])
+    db.session.commit()
+
+
+def list_bookings(app, count_queries, email, **params):
+    db.session.expunge_all()
+    with count_queries() as counter:
+        response = app.test_client().get("/api/bookings", query_string={"email": email, **params})
+    assert response.status_code == 200
+    return response.get_json(), counter.count
+
+
+def test_bookings_list_query_count_is_constant(app, count_queries):
+    client = User(username="cliente", email="cliente@example.com", password="x", role="Cliente")
+    db.session.add(client)
+    db.session.commit()
+    client_id = client.id
+
+    add_bookings(client_id, 3)
+    few, few_queries = list_bookings(app, count_queries, "cliente@example.com")
+
+    add_bookings(client_id, 12)
+    many, many_queries = list_bookings(app, count_queries, "cliente@example.com")
+
+    assert len(few) == 3 and len(many) == 15
+    assert all(b["pilot_name"] and b["service_name"] == "Boda" for b in many)
+    assert all(b["payment_status"] == "succeeded" for b in many)
+    assert many_queries == few_queries
+
+    page, page_queries = list_bookings(app, count_queries, "cliente@example.com", limit=5)
+    assert len(page) == 5
+    assert page_queries == few_queries
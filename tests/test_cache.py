@@ -0,0 +1,46 @@
+import sqlite3
+
+from cache import SQLiteCacheBackend
+
+
+def stored_hits(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT value FROM cache_stats WHERE name = 'hits'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_sqlite_cache_reads_do_not_write_until_flush(tmp_path):
+    path = str(tmp_path / "cache.db")
+    backend = SQLiteCacheBackend(path, flush_every=10, flush_interval=3600)
+    backend.set("a", {"x": 1}, ttl=60)
+
+    for _ in range(5):
+        assert backend.get("a") == {"x": 1}
+    assert backend.get("missing") is None
+    assert stored_hits(path) == 0
+
+    assert backend.stats() == {"hits": 5, "misses": 1, "size": 1}
+    assert stored_hits(path) == 5
+
+
+def test_sqlite_cache_flushes_every_n_reads(tmp_path):
+    path = str(tmp_path / "cache.db")
+    backend = SQLiteCacheBackend(path, flush_every=3, flush_interval=3600)
+    backend.set("a", 1, ttl=60)
+
+    for _ in range(3):
+        backend.get("a")
+    assert stored_hits(path) == 3
+
+
+def test_sqlite_cache_eviction_uses_pending_access_times(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"), max_entries=2, flush_every=100, flush_interval=3600)
+    backend.set("old", 1, ttl=60)
+    backend.set("new", 2, ttl=60)
+    backend.get("old")  # acceso aún sin volcar
+    backend.set("third", 3, ttl=60)
+
+    assert backend.get("old") == 1
+    assert backend.get("new") is None
@@ -0,0 +1,26 @@
+from chat_broker import InProcessBroker, broker_from_env
+
+
+def test_in_process_broker_delivers_to_subscribers():
+    broker = InProcessBroker()
+    subscription = broker.subscribe("user:1")
+    broker.publish("user:1", {"event": "message", "data": {"id": 1}})
+    broker.publish("user:2", {"event": "message", "data": {"id": 2}})
+
+    assert subscription.get(timeout=0) == {"event": "message", "data": {"id": 1}}
+    assert subscription.get(timeout=0) is None
+
+
+def test_push_is_opt_in(monkeypatch):
+    monkeypatch.delenv("CHAT_BROKER", raising=False)
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    assert broker_from_env() is None
+
+
+def test_memory_broker_disabled_with_several_workers(monkeypatch):
+    monkeypatch.setenv("CHAT_BROKER", "memory")
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert broker_from_env() is None
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    assert isinstance(broker_from_env(), InProcessBroker)
@@ -0,0 +1,87 @@
+from flask import g
+
+from backend_sqlite import db, User, PilotProfile
+
+
+def make_conversation(app):
+    client = User(username="cliente", email="cliente@example.com", password="x", role="Cliente")
+    pilot_user = User(username="piloto", email="piloto@example.com", password="x", role="Piloto")
+    db.session.add_all([client, pilot_user])
+    db.session.flush()
+    profile = PilotProfile(name="Piloto", user_id=pilot_user.id)
+    db.session.add(profile)
+    db.session.commit()
+
+    http = app.test_client()
+    response = http.post("/api/conversations", json={"client_email": "cliente@example.com",
+                                                     "pilot_profile_id": profile.id})
+    assert response.status_code in (200, 201)
+    return http, response.get_json()["conversation"]["id"]
+
+
+def send(http, conversation_id, email, content):
+    response = http.post(f"/api/conversations/{conversation_id}/messages",
+                         json={"sender_email": email, "content": content})
+    assert response.status_code in (200, 201)
+
+
+def fetch(http, conversation_id, **params):
+    response = http.get(f"/api/conversations/{conversation_id}/messages",
+                        query_string={"email": "cliente@example.com", **params})
+    assert response.status_code == 200
+    return [m["content"] for m in response.get_json()["messages"]], response.headers.get("X-Next-Cursor")
+
+
+def test_after_id_pages_forward_with_cursor(app):
+    http, conversation_id = make_conversation(app)
+    for i in range(5):
+        send(http, conversation_id, "piloto@example.com", f"m{i}")
+
+    pages, cursor = [], 0
+    while cursor is not None:
+        page, cursor = fetch(http, conversation_id, after_id=cursor, limit=2)
+        pages.append(page)
+    assert pages == [["m0", "m1"], ["m2", "m3"], ["m4"]]
+
+
+def test_before_id_pages_backward_with_cursor(app):
+    http, conversation_id = make_conversation(app)
+    for i in range(5):
+        send(http, conversation_id, "piloto@example.com", f"m{i}")
+
+    page, cursor = fetch(http, conversation_id, limit=2)
+    assert page == ["m3", "m4"]
+    page, cursor = fetch(http, conversation_id, before_id=cursor, limit=2)
+    assert page == ["m1", "m2"]
+    page, cursor = fetch(http, conversation_id, before_id=cursor, limit=2)
+    assert page == ["m0"] and cursor is None
+
+
+def test_poll_without_new_messages_is_cheap(app, count_queries):
+    http, conversation_id = make_conversation(app)
+    send(http, conversation_id, "piloto@example.com", "hola")
+    page, _ = fetch(http, conversation_id, after_id=0)
+    assert page == ["hola"]
+
+    last_id = db.session.execute(db.text("SELECT max(id) FROM message")).scalar()
+    db.session.expunge_all()
+    g.pop("identity_cache", None)  # el contexto de la app del fixture se comparte entre peticiones
+    with count_queries() as counter:
+        page, _ = fetch(http, conversation_id, after_id=last_id)
+    assert page == []
+    # Ni escrituras (la marca de lectura ya está al día) ni resolución de participantes
+    assert not any(s.lstrip().upper().startswith(("UPDATE", "INSERT")) for s in counter.statements)
+    assert counter.count <= 4
+
+
+def test_messages_marked_read_without_last_message_id(app):
+    http, conversation_id = make_conversation(app)
+    send(http, conversation_id, "piloto@example.com", "hola")
+    # Conversación de una BD antigua sin last_message_id recalculado
+    db.session.execute(db.text("UPDATE conversation SET last_message_id = NULL, client_unread = 1"))
+    db.session.commit()
+
+    fetch(http, conversation_id)
+    response = http.get("/api/chat/unread-count", query_string={"email": "cliente@example.com"})
+    assert response.get_json()["unread_count"] == 0
+    assert db.session.execute(db.text("SELECT count(*) FROM message WHERE is_read = 0")).scalar() == 0
@@ -0,0 +1,37 @@
+from gazetteer import Gazetteer, geocode
+from query_parser import parse_search_query
+
+
+def test_full_list_includes_smaller_municipalities():
+    assert len(Gazetteer.from_csv()) > 6000
+    place = geocode("Puerto de la Cruz")
+    assert place["province"] == "Santa Cruz de Tenerife"
+
+
+def test_province_disambiguates_homonyms():
+    assert geocode("Mieres, Girona")["province"] == "Girona"
+    assert geocode("Mieres, Asturias")["province"] == "Asturias"
+
+
+def test_prefix_fallback_requires_a_single_match():
+    assert geocode("Sal") is None
+    assert geocode("Valenc") is None
+    assert geocode("Alcoben")["name"] == "Alcobendas"
+
+
+def test_common_words_are_not_places():
+    assert parse_search_query("fotos de un tejado en el campo")["city"] is None
+
+
+def test_articles_and_common_words_are_not_single_word_towns():
+    for query in ["necesito un piloto para una boda", "inspeccion de una torre",
+                  "filmar una carrera ciclista", "grabacion de la feria", "Feria de abril",
+                  "fotos del pinar", "fuentes de luz"]:
+        assert parse_search_query(query)["city"] is None, query
+
+
+def test_single_word_town_after_preposition_or_capitalized():
+    assert parse_search_query("boda en nava")["city"]["name"] == "Nava"
+    assert parse_search_query("fotos aereas de Madrid")["city"]["name"] == "Madrid"
+    assert parse_search_query("piloto barato Valencia")["city"]["name"] == "Valencia"
+    assert parse_search_query("inmobiliaria en san sebastian de los reyes")["city"]["province"] == "Madrid"
@@ -0,0 +1,55 @@
+"""
+Comprueba con EXPLAIN que /api/pilots/nearby usa el índice GiST en PostgreSQL.
+
+Necesita TEST_POSTGRES_URL (con permiso para crear las extensiones cube y
+earthdistance). Todo se hace en tablas temporales dentro de una transacción
+que se deshace al terminar.
+"""
+
+import os
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+from psycopg2.extras import RealDictCursor  # noqa: E402
+
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL no configurada")
+
+PILOT_ROWS = 20000
+
+
+@pytest.fixture
+def cur():
+    from setup_geo_index import GEO_EXTENSIONS_SQL, GEO_INDEX_SQL
+
+    conn = psycopg2.connect(POSTGRES_URL, cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    try:
+        for statement in GEO_EXTENSIONS_SQL:
+            cur.execute(statement)
+        # Las tablas temporales tapan a las reales durante la transacción
+        cur.execute('CREATE TEMP TABLE users (id integer PRIMARY KEY, username text)')
+        cur.execute('''CREATE TEMP TABLE pilot_profiles (
+            id integer PRIMARY KEY, user_id integer, name text,
+            latitude double precision, longitude double precision)''')
+        cur.execute('INSERT INTO users SELECT i, %s || i FROM generate_series(1, %s) i', ('piloto', PILOT_ROWS))
+        # Pilotos repartidos por la península
+        cur.execute('''INSERT INTO pilot_profiles
+            SELECT i, i, 'Piloto ' || i, 36 + random() * 7.8, -9.3 + random() * 12.6
+            FROM generate_series(1, %s) i''', (PILOT_ROWS,))
+        cur.execute(GEO_INDEX_SQL)
+        cur.execute('ANALYZE users')
+        cur.execute('ANALYZE pilot_profiles')
+        yield cur
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+
+def test_nearby_query_uses_gist_index(cur):
+    from setup_geo_index import GEO_INDEX_NAME, nearby_plan
+
+    plan = nearby_plan(cur, lat=40.4168, lng=-3.7038, radius_km=25)
+    assert GEO_INDEX_NAME in plan, plan
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime, timedelta
+
+import backend_sqlite
+from backend_sqlite import db, Job, run_pending_jobs
+from mailer import Mailer, SMTPConnectionPool
+
+
+def make_mailer(smtp_server):
+    return Mailer(SMTPConnectionPool("127.0.0.1", port=smtp_server.port, use_tls=False))
+
+
+def test_send_batch_reuses_one_smtp_connection(smtp_server):
+    m = make_mailer(smtp_server)
+
+    assert m.send_batch([("a@x.com", "Uno", "<p>1</p>")]) == {"a@x.com": None}
+    assert m.send_batch([("b@x.com", "Dos", "<p>2</p>")]) == {"b@x.com": None}
+
+    assert smtp_server.connections == 1
+    assert [msg["To"] for msg in smtp_server.messages] == ["a@x.com", "b@x.com"]
+
+
+def test_send_batch_sends_one_digest_per_recipient(smtp_server):
+    m = make_mailer(smtp_server)
+
+    results = m.send_batch([
+        ("a@x.com", "Nueva Reserva", "<p>1</p>"),
+        ("b@x.com", "Pago Recibido", "<p>2</p>"),
+        ("a@x.com", "Reserva Confirmada", "<p>3</p>"),
+    ])
+
+    assert results == {"a@x.com": None, "b@x.com": None}
+    sent = {msg["To"]: msg for msg in smtp_server.messages}
+    assert len(smtp_server.messages) == 2
+    assert sent["a@x.com"]["Subject"] == "Tienes 2 novedades en DroneBook"
+    assert sent["b@x.com"]["Subject"] == "Pago Recibido"
+
+
+def test_broken_connection_is_replaced(smtp_server):
+    m = make_mailer(smtp_server)
+    m.send_batch([("a@x.com", "Uno", "<p>1</p>")])
+    m.pool._idle[0].close()  # la conexión inactiva se ha cortado
+
+    assert m.send_batch([("b@x.com", "Dos", "<p>2</p>")]) == {"b@x.com": None}
+    assert smtp_server.connections == 2
+
+
+def add_email_job(to_email, run_in_seconds, n):
+    db.session.add(Job(
+        job_type='email', coalesce_key=to_email,
+        payload=json.dumps({"to_email": to_email, "subject": f"Aviso {n}", "html_content": f"<p>{n}</p>"}),
+        run_at=datetime.utcnow() + timedelta(seconds=run_in_seconds)
+    ))
+
+
+def test_staggered_emails_to_one_recipient_go_out_together(app, smtp_server, monkeypatch):
+    monkeypatch.setattr(backend_sqlite, "mailer", make_mailer(smtp_server))
+    # Eventos separados más que una vuelta del worker: solo el primero ha vencido
+    add_email_job("a@x.com", -1, 1)
+    add_email_job("a@x.com", 10, 2)
+    add_email_job("a@x.com", 25, 3)
+    add_email_job("b@x.com", 10, 4)
+    db.session.commit()
+
+    assert run_pending_jobs() == (3, 0)
+
+    assert len(smtp_server.messages) == 1
+    assert smtp_server.messages[0]["To"] == "a@x.com"
+    assert smtp_server.messages[0]["Subject"] == "Tienes 3 novedades en DroneBook"
+    assert Job.query.filter_by(status='pending').one().coalesce_key == "b@x.com"
@@ -0,0 +1,62 @@
+from datetime import date, time
+
+import backend_sqlite
+from backend_sqlite import (
+    db, User, PilotProfile, ServicePackage, PortfolioItem, Badge, AvailabilitySlot, pilots_to_dicts
+)
+
+
+def add_pilots(n):
+    start = PilotProfile.query.count()
+    for i in range(start, start + n):
+        user = User(username=f"piloto{i}", email=f"piloto{i}@example.com", password="x", role="Piloto")
+        db.session.add(user)
+        db.session.flush()
+        profile = PilotProfile(name=f"Piloto {i}", location="Madrid", user_id=user.id)
+        db.session.add(profile)
+        db.session.flush()
+        db.session.add_all([
+            ServicePackage(name="Boda", description="Vídeo", price=100 + i, pilot_profile_id=profile.id),
+            ServicePackage(name="Inmobiliaria", description="Fotos", price=80 + i, pilot_profile_id=profile.id),
+            PortfolioItem(file_url=f"/uploads/{i}.jpg", pilot_profile_id=profile.id),
+            Badge(badge_type="verified", name="Verificado", pilot_profile_id=profile.id),
+            AvailabilitySlot(pilot_profile_id=profile.id, date=date(2030, 1, 1),
+                             start_time=time(9), end_time=time(13)),
+        ])
+    db.session.commit()
+
+
+def serialize_all(count_queries):
+    db.session.expunge_all()
+    with count_queries() as counter:
+        result = pilots_to_dicts(PilotProfile.query.all())
+    return result, counter.count
+
+
+def test_pilots_to_dicts_query_count_is_constant(count_queries):
+    add_pilots(3)
+    few, few_queries = serialize_all(count_queries)
+
+    add_pilots(12)
+    many, many_queries = serialize_all(count_queries)
+
+    assert len(few) == 3 and len(many) == 15
+    assert all(len(p["eventPackages"]) == 2 and p["badges"] and p["availability"] for p in many)
+    assert many_queries == few_queries
+
+
+def test_pilot_list_is_paginated_by_default(app, monkeypatch):
+    monkeypatch.setattr(backend_sqlite, "PILOTS_PAGE_DEFAULT", 4)
+    add_pilots(10)
+    http = app.test_client()
+
+    seen, cursor = [], None
+    while True:
+        response = http.get("/api/pilots", query_string={"view": "summary", **({"cursor": cursor} if cursor else {})})
+        page = response.get_json()
+        assert len(page) <= 4
+        seen += [p["id"] for p in page]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == sorted(seen) and len(seen) == 10
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import backend_sqlite
+
+
+class SlowModel:
+    """Modelo de IA falso que emite fragmentos sin fin y anota cuántos ha generado"""
+
+    def __init__(self):
+        self.produced = 0
+        self.stopped = threading.Event()
+
+    def generate_content(self, prompt, stream=False):
+        try:
+            while True:
+                self.produced += 1
+                yield type("Chunk", (), {"text": f"parte {self.produced} "})()
+                time.sleep(0.01)
+        finally:
+            self.stopped.set()
+
+
+def test_disconnect_stops_the_producer(app, monkeypatch):
+    model = SlowModel()
+    monkeypatch.setattr(backend_sqlite, "model", model)
+
+    response = app.test_client().get("/api/search/stream", query_string={"query": "boda en Sevilla"},
+                                     buffered=False)
+    events = iter(response.response)
+    assert next(events).startswith(b"event: filters")
+    assert next(events).startswith(b"event: chunk")
+    response.close()  # el cliente se desconecta
+
+    assert model.stopped.wait(timeout=2)
+    produced = model.produced
+    time.sleep(0.1)
+    assert model.produced == produced
@@ -0,0 +1,165 @@
+"""
+Índice de texto BM25 en memoria para la búsqueda instantánea de pilotos
+"""
+
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+STOPWORDS = {
+    'a', 'al', 'con', 'de', 'del', 'el', 'en', 'la', 'las', 'lo', 'los', 'mi', 'o', 'para',
+    'por', 'que', 'se', 'su', 'sus', 'un', 'una', 'unos', 'unas', 'y',
+}
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def tokenize(text):
+    """Tokens en minúsculas y sin tildes, sin palabras vacías"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return [t for t in re.findall(r"[a-z0-9]+", text) if t not in STOPWORDS]
+
+
+class PilotTextIndex:
+    """Índice invertido BM25 con altas, cambios y bajas incrementales.
+
+    Cada documento es una lista de (texto, peso); el peso repite los tokens
+    del campo para que, p. ej., el nombre cuente más que la bio. Junto a cada
+    documento se guardan sus datos de filtrado (precio, badges, valoración...).
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.version = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._terms = {}     # pilot_id -> Counter de términos
+        self._lengths = {}   # pilot_id -> nº de tokens
+        self._facts = {}     # pilot_id -> datos para filtrar
+        self._postings = {}  # término -> {pilot_id: frecuencia}
+        self._total_length = 0
+        self._sorted_terms = None
+
+    @staticmethod
+    def _analyze(fields):
+        terms = Counter()
+        for text, weight in fields:
+            for token in tokenize(text):
+                terms[token] += weight
+        return terms
+
+    def _add(self, pilot_id, terms, facts):
+        self._facts[pilot_id] = facts
+        self._terms[pilot_id] = terms
+        self._lengths[pilot_id] = sum(terms.values())
+        self._total_length += self._lengths[pilot_id]
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._sorted_terms = None
+            postings[pilot_id] = tf
+
+    def _discard(self, pilot_id):
+        self._facts.pop(pilot_id, None)
+        terms = self._terms.pop(pilot_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._lengths.pop(pilot_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[pilot_id]
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def rebuild(self, documents, version=None):
+        """documents: iterable de (pilot_id, [(texto, peso), ...], datos)"""
+        analyzed = [(pid, self._analyze(fields), facts) for pid, fields, facts in documents]
+        with self._lock:
+            self._reset()
+            for pid, terms, facts in analyzed:
+                self._add(pid, terms, facts)
+            self.version = version
+
+    def upsert(self, pilot_id, fields, facts):
+        terms = self._analyze(fields)
+        with self._lock:
+            self._discard(pilot_id)
+            self._add(pilot_id, terms, facts)
+
+    def remove(self, pilot_id):
+        with self._lock:
+            self._discard(pilot_id)
+
+    def _expand_prefix(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        matches = []
+        for term in self._sorted_terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def _score_term(self, term, avg_length):
+        postings = self._postings.get(term)
+        if not postings:
+            return {}
+        n = len(postings)
+        ids = list(postings)
+        tf = np.fromiter(postings.values(), dtype=np.float64, count=n)
+        lengths = np.fromiter((self._lengths[pid] for pid in ids), dtype=np.float64, count=n)
+        idf = math.log(1 + (len(self._terms) - n + 0.5) / (n + 0.5))
+        scores = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / avg_length))
+        return dict(zip(ids, scores.tolist()))
+
+    def search(self, query, prefix=True):
+        """Devuelve {pilot_id: puntuación} de los documentos que contienen todos los términos.
+
+        Con prefix=True el último término se trata como prefijo (búsqueda mientras se escribe).
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+
+        with self._lock:
+            if not self._terms:
+                return {}
+            avg_length = self._total_length / len(self._terms) or 1.0
+            slots = [[t] for t in tokens]
+            if prefix and query and query[-1].isalnum():
+                slots[-1] = self._expand_prefix(tokens[-1]) or [tokens[-1]]
+
+            scores = None
+            for slot in slots:
+                # Dentro de un prefijo cuenta la mejor expansión, no la suma de todas
+                slot_scores = {}
+                for term in slot:
+                    for pid, score in self._score_term(term, avg_length).items():
+                        if score > slot_scores.get(pid, 0.0):
+                            slot_scores[pid] = score
+                if scores is None:
+                    scores = slot_scores
+                else:
+                    scores = {pid: s + slot_scores[pid] for pid, s in scores.items() if pid in slot_scores}
+                if not scores:
+                    return {}
+        return scores
+
+    def facts(self):
+        """Copia de {pilot_id: datos} de todos los documentos"""
+        with self._lock:
+            return dict(self._facts)
+
+    def __len__(self):
+        return len(self._terms)